@@ -0,0 +1,342 @@
+"""
+An append-only archive of the raw request and response PARMLISTs
+exchanged with the gateway, for settling disputes and for checking parser
+changes against real traffic.
+
+Exchanges are redacted before they are written: the values of card
+numbers, security codes and passwords are masked in place, keeping their
+length so that the PARMLIST stays parseable. Records are appended to
+segment files that are rotated once they reach `segment_size` bytes, and
+may be compressed individually with zlib. Each segment has an index file
+mapping request IDs and PNREFs to record offsets.
+
+Example usage:
+
+    archive = ParmlistArchive('/var/lib/payflowpro/archive', compress=True)
+    client = PayflowProClient(..., archive=archive)
+
+    # Later, or in another process
+    exchange = archive.lookup(pnref='V19A2E42B0F1')
+
+The archive can also be replayed from the command line, re-parsing every
+response with the current parser. This doubles as a parser throughput
+benchmark:
+
+    $ python -m payflowpro.archive replay /var/lib/payflowpro/archive
+"""
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+from .classes import parse_parameters
+from .client import parse_parmlist
+
+SEGMENT_MAGIC = b'PFPA\x01' # Segment file header, including format version
+SEGMENT_SUFFIX = '.pfa'
+INDEX_SUFFIX = '.idx'
+
+# Record header: payload length, flags, timestamp
+RECORD_HEADER = struct.Struct('<IBd')
+# Payload header: lengths of the request ID, PNREF, request and response
+PAYLOAD_HEADER = struct.Struct('<HHII')
+
+COMPRESSED = 0x01
+
+# Parameters whose values are masked before they are archived. Card numbers
+# keep their last four digits.
+SENSITIVE_PARAMETERS = ('ACCT', 'CVV2', 'PWD', 'SWIPE', 'MICR')
+PARTIAL_PARAMETERS = ('ACCT',)
+
+_NAME_RE = re.compile(br'(?:^|&)([A-Z0-9_]+)(\[\d+\])?=')
+
+
+def redact_parmlist(parmlist, names=SENSITIVE_PARAMETERS):
+    """
+    Masks the values of the named parameters in a PARMLIST string with
+    'X' characters, leaving the length of each value unchanged. Lengths
+    are counted in UTF-8 bytes, as in the `[n]` suffixes of the names, so
+    each byte of a masked value becomes one 'X'.
+    """
+    data = parmlist.encode('utf-8')
+    names = [name.encode('ascii') for name in names]
+    partial = [name.encode('ascii') for name in PARTIAL_PARAMETERS]
+    pieces = []
+    last = 0
+    matches = list(_NAME_RE.finditer(data))
+    for i, match in enumerate(matches):
+        name, len_suffix = match.groups()
+        if name not in names or match.start() < last:
+            continue
+        start = match.end()
+        if len_suffix:
+            end = start + int(len_suffix[1:-1])
+        elif i + 1 < len(matches):
+            end = matches[i + 1].start()
+        else:
+            end = len(data)
+        end = min(end, len(data))
+        keep = 4 if name in partial else 0
+        masked = start + max(end - start - keep, 0)
+        # Don't leave part of a multi-byte character unmasked
+        while masked < end and 0x80 <= data[masked] < 0xC0:
+            masked += 1
+        pieces.append(data[last:start])
+        pieces.append(b'X' * (masked - start))
+        last = masked
+    pieces.append(data[last:])
+    return b''.join(pieces).decode('utf-8')
+
+
+class ArchivedExchange(object):
+    def __init__(self, request_id, pnref, timestamp, request, response):
+        self.request_id = request_id
+        self.pnref = pnref
+        self.timestamp = timestamp
+        self.request = request
+        self.response = response
+
+    def __str__(self):
+        return 'ArchivedExchange %s (%s) at %s' % (
+            self.request_id, self.pnref, self.timestamp)
+
+
+def _encode_record(request_id, pnref, request, response, timestamp, compress):
+    fields = [str(value or '').encode('utf-8') for value in
+              (request_id, pnref, request, response)]
+    payload = PAYLOAD_HEADER.pack(*map(len, fields)) + b''.join(fields)
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload, 1)
+        flags |= COMPRESSED
+    return RECORD_HEADER.pack(len(payload), flags, timestamp) + payload
+
+
+def _decode_payload(payload, flags, timestamp):
+    if flags & COMPRESSED:
+        payload = zlib.decompress(payload)
+    lengths = PAYLOAD_HEADER.unpack_from(payload)
+    values = []
+    offset = PAYLOAD_HEADER.size
+    for length in lengths:
+        values.append(payload[offset:offset + length].decode('utf-8'))
+        offset += length
+    request_id, pnref, request, response = values
+    return ArchivedExchange(request_id, pnref or None, timestamp, request, response)
+
+
+def iter_segment(path, offset=None):
+    """
+    Yields `(offset, ArchivedExchange)` for the records of a segment file,
+    which is memory-mapped rather than read. A record left incomplete by a
+    crash ends the iteration.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= len(SEGMENT_MAGIC):
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+                raise ValueError('%s is not an archive segment' % path)
+            position = len(SEGMENT_MAGIC) if offset is None else offset
+            size = len(data)
+            while position + RECORD_HEADER.size <= size:
+                length, flags, timestamp = RECORD_HEADER.unpack_from(data, position)
+                start = position + RECORD_HEADER.size
+                if start + length > size:
+                    break
+                yield position, _decode_payload(data[start:start + length], flags, timestamp)
+                if offset is not None:
+                    break
+                position = start + length
+        finally:
+            data.close()
+
+
+class ParmlistArchive(object):
+    """
+    An archive of redacted raw exchanges stored in `directory`.
+
+    Several processes may write to the same directory, since every process
+    appends to segment files of its own.
+    """
+
+    SEGMENT_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, compress=False,
+        sensitive_parameters=SENSITIVE_PARAMETERS):
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self.compress = compress
+        self.sensitive_parameters = sensitive_parameters
+        self._lock = threading.Lock()
+        self._segment = None
+        self._index = None
+        self._pid = None
+        self._sequence = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _open_segment(self):
+        self._sequence += 1
+        base = os.path.join(self.directory, '%015d-%d-%d' % (
+            int(time.time() * 1000), os.getpid(), self._sequence))
+        segment = open(base + SEGMENT_SUFFIX, 'ab')
+        segment.write(SEGMENT_MAGIC)
+        index = open(base + INDEX_SUFFIX, 'a')
+        self._segment = (segment, index, base + SEGMENT_SUFFIX)
+        self._pid = os.getpid()
+
+    def record(self, request_id, request, response, pnref=None):
+        """
+        Appends an exchange to the archive. `request` and `response` are
+        the raw PARMLIST strings; both are redacted before being written.
+        """
+        data = _encode_record(request_id, pnref,
+            redact_parmlist(request, self.sensitive_parameters),
+            redact_parmlist(response, self.sensitive_parameters),
+            time.time(), self.compress)
+        with self._lock:
+            if self._segment is None or self._pid != os.getpid():
+                # A forked child must not share its parent's files
+                self._open_segment()
+            segment, index, path = self._segment
+            offset = segment.tell()
+            segment.write(data)
+            segment.flush()
+            index.write('%s\t%s\t%d\n' % (request_id, pnref or '', offset))
+            index.flush()
+            if self._index is not None:
+                self._add_to_index(request_id, pnref, path, offset)
+            if offset + len(data) >= self.segment_size:
+                self._close_segment()
+
+    def _close_segment(self):
+        if self._segment is not None:
+            segment, index, path = self._segment
+            segment.close()
+            index.close()
+            self._segment = None
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    def segments(self):
+        """Returns the paths of the archive's segment files, oldest first."""
+        return sorted(os.path.join(self.directory, name)
+                      for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def __iter__(self):
+        for path in self.segments():
+            for offset, exchange in iter_segment(path):
+                yield exchange
+
+    def _add_to_index(self, request_id, pnref, path, offset):
+        by_request_id, by_pnref = self._index
+        by_request_id[str(request_id)] = (path, offset)
+        if pnref:
+            by_pnref[pnref] = (path, offset)
+
+    def _load_index(self):
+        self._index = ({}, {})
+        for path in self.segments():
+            index_path = path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+            if not os.path.exists(index_path):
+                continue
+            with open(index_path) as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) == 3:
+                        self._add_to_index(parts[0], parts[1], path, int(parts[2]))
+
+    def lookup(self, request_id=None, pnref=None):
+        """
+        Returns the most recent `ArchivedExchange` with the given request
+        ID or PNREF, or None. The index files are read on the first lookup.
+        """
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            if request_id is not None:
+                location = self._index[0].get(str(request_id))
+            else:
+                location = self._index[1].get(pnref)
+        if location is None:
+            return None
+        for offset, exchange in iter_segment(location[0], location[1]):
+            return exchange
+        return None
+
+
+def replay(directory, parse_objects=True):
+    """
+    Re-parses every archived response with `parse_parmlist` and, unless
+    `parse_objects` is false, `parse_parameters`. Returns a dictionary of
+    counts and the elapsed time, including the number of responses whose
+    parse left unconsumed data.
+    """
+    stats = dict(records=0, bytes=0, unconsumed=0, errors=0)
+    started = time.time()
+    for path in ParmlistArchive(directory).segments():
+        for offset, exchange in iter_segment(path):
+            stats['records'] += 1
+            stats['bytes'] += len(exchange.response)
+            try:
+                results = parse_parmlist(exchange.response)
+                if parse_objects:
+                    result_objects, unconsumed_data = parse_parameters(results)
+                    if unconsumed_data:
+                        stats['unconsumed'] += 1
+            except Exception:
+                stats['errors'] += 1
+    stats['seconds'] = time.time() - started
+    return stats
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m payflowpro.archive',
+        description='Inspect and replay a Payflow Pro PARMLIST archive.')
+    commands = parser.add_subparsers(dest='command')
+    replay_parser = commands.add_parser('replay',
+        help='re-parse every archived response and report throughput')
+    replay_parser.add_argument('directory')
+    replay_parser.add_argument('--parmlist-only', action='store_true',
+        help='only run parse_parmlist, not parse_parameters')
+    show_parser = commands.add_parser('show', help='print an archived exchange')
+    show_parser.add_argument('directory')
+    show_parser.add_argument('--request-id')
+    show_parser.add_argument('--pnref')
+    args = parser.parse_args(argv)
+
+    if args.command == 'replay':
+        stats = replay(args.directory, parse_objects=not args.parmlist_only)
+        rate = stats['records'] / stats['seconds'] if stats['seconds'] else 0
+        print('%(records)d records, %(bytes)d bytes in %(seconds).3fs' % stats)
+        print('%.0f records/s, %d with unconsumed data, %d errors' % (
+            rate, stats['unconsumed'], stats['errors']))
+    elif args.command == 'show':
+        exchange = ParmlistArchive(args.directory).lookup(
+            request_id=args.request_id, pnref=args.pnref)
+        if exchange is None:
+            print('Not found')
+            return 1
+        print(exchange)
+        print('Request:  %s' % exchange.request)
+        print('Response: %s' % exchange.response)
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
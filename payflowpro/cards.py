@@ -0,0 +1,188 @@
+"""
+Batch normalization and pre-validation of credit card account numbers.
+
+Checking account numbers locally lets bulk loads and batch authorizations
+drop malformed cards before they cost a gateway round trip and a decline.
+`check_accounts` normalizes a sequence of `acct` values the same way as
+`CreditCardField`, then checks each one's format, length, Luhn checksum
+and issuer (BIN) range. The checks are vectorized with NumPy when it is
+installed, and fall back to pure Python otherwise.
+
+Example usage:
+
+    valid, invalid = partition_cards(credit_cards)
+    for credit_card in valid:
+        client.authorization(credit_card, amount)
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .classes import normalize_account
+
+# Results of `check_accounts`
+VALID = 0
+INVALID_FORMAT = 1 # Empty, or contains characters other than digits
+INVALID_LENGTH = 2 # Not between MIN_LENGTH and MAX_LENGTH digits
+INVALID_CHECKSUM = 3 # Fails the Luhn check
+UNKNOWN_RANGE = 4 # Not in any of the accepted issuer ranges, or wrong length for it
+
+MIN_LENGTH = 12
+MAX_LENGTH = 19
+
+# Accepted issuer ranges: (first prefix, last prefix, card number lengths).
+# Both prefixes have the same number of digits.
+CARD_RANGES = [
+    (4, 4, (13, 16, 19)), # Visa
+    (51, 55, (16,)), # MasterCard
+    (2221, 2720, (16,)), # MasterCard 2-series
+    (34, 34, (15,)), # American Express
+    (37, 37, (15,)), # American Express
+    (6011, 6011, (16, 17, 18, 19)), # Discover
+    (644, 649, (16, 17, 18, 19)), # Discover
+    (65, 65, (16, 17, 18, 19)), # Discover
+    (300, 305, (14, 15, 16, 17, 18, 19)), # Diners Club
+    (36, 36, (14, 15, 16, 17, 18, 19)), # Diners Club
+    (38, 39, (14, 15, 16, 17, 18, 19)), # Diners Club
+    (3528, 3589, (16, 17, 18, 19)), # JCB
+    (62, 62, (16, 17, 18, 19)), # China UnionPay
+    (50, 50, (12, 13, 14, 15, 16, 17, 18, 19)), # Maestro
+    (56, 58, (12, 13, 14, 15, 16, 17, 18, 19)), # Maestro
+    (67, 67, (12, 13, 14, 15, 16, 17, 18, 19)), # Maestro
+]
+
+_PREFIX_DIGITS = 6
+
+
+def normalize_accounts(values):
+    """
+    Normalizes a sequence of `acct` values, returning a list of strings.
+    Numbers are converted to their decimal digits, and missing values to
+    empty strings.
+    """
+    accounts = []
+    for value in values:
+        value = normalize_account(value)
+        if value is None:
+            value = ''
+        elif not isinstance(value, str):
+            value = str(value)
+        accounts.append(value)
+    return accounts
+
+
+def _in_ranges(account, ranges):
+    length = len(account)
+    for low, high, lengths in ranges:
+        digits = len(str(low))
+        if length in lengths and low <= int(account[:digits]) <= high:
+            return True
+    return False
+
+
+def _luhn_ok(account):
+    total = 0
+    for i, digit in enumerate(reversed(account)):
+        digit = ord(digit) - 48
+        if i % 2:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return total % 10 == 0
+
+
+def _check_python(accounts, ranges):
+    codes = []
+    for account in accounts:
+        if not (account.isdigit() and account.isascii()):
+            codes.append(INVALID_FORMAT)
+        elif not MIN_LENGTH <= len(account) <= MAX_LENGTH:
+            codes.append(INVALID_LENGTH)
+        elif not _luhn_ok(account):
+            codes.append(INVALID_CHECKSUM)
+        elif not _in_ranges(account, ranges):
+            codes.append(UNKNOWN_RANGE)
+        else:
+            codes.append(VALID)
+    return codes
+
+
+def _check_numpy(accounts, ranges):
+    count = len(accounts)
+    lengths = numpy.fromiter(map(len, accounts), dtype=numpy.int64, count=count)
+
+    # A fixed-width unicode array, truncated one character past the longest
+    # valid number, viewed as a matrix of code points padded with zeros.
+    width = MAX_LENGTH + 1
+    points = numpy.array(accounts, dtype='U%d' % width).view(numpy.uint32) \
+        .reshape(count, width).astype(numpy.int64)
+    columns = numpy.arange(width)
+    inside = columns < lengths[:, None]
+    digits = numpy.where(inside, points - 48, 0)
+
+    well_formed = (lengths > 0) & (((digits >= 0) & (digits <= 9)) | ~inside).all(axis=1)
+    for i in numpy.flatnonzero(lengths > width):
+        # Characters past the truncation point are checked individually
+        well_formed[i] = accounts[i].isdigit() and accounts[i].isascii()
+    plausible = well_formed & (lengths >= MIN_LENGTH) & (lengths <= MAX_LENGTH)
+
+    # Luhn: double every second digit counting from the right-most one
+    doubled = inside & ((lengths[:, None] - 1 - columns) % 2 == 1)
+    weighted = numpy.where(doubled, digits * 2, digits)
+    weighted = numpy.where(weighted > 9, weighted - 9, weighted)
+    luhn_ok = weighted.sum(axis=1) % 10 == 0
+
+    prefix = digits[:, :_PREFIX_DIGITS].dot(10 ** numpy.arange(_PREFIX_DIGITS - 1, -1, -1))
+    in_range = numpy.zeros(count, dtype=bool)
+    for low, high, range_lengths in ranges:
+        scale = 10 ** (_PREFIX_DIGITS - len(str(low)))
+        in_range |= (prefix // scale >= low) & (prefix // scale <= high) \
+            & numpy.isin(lengths, range_lengths)
+
+    codes = numpy.zeros(count, dtype=numpy.uint8)
+    codes[~in_range] = UNKNOWN_RANGE
+    codes[~luhn_ok] = INVALID_CHECKSUM
+    codes[~plausible] = INVALID_LENGTH
+    codes[~well_formed] = INVALID_FORMAT
+    return codes
+
+
+def check_accounts(values, ranges=CARD_RANGES, use_numpy=None):
+    """
+    Normalizes and checks a sequence of `acct` values, returning one of
+    VALID, INVALID_FORMAT, INVALID_LENGTH, INVALID_CHECKSUM or
+    UNKNOWN_RANGE for each. The result is a NumPy array if NumPy was used
+    (by default, whenever it is installed) and a list otherwise.
+    """
+    accounts = normalize_accounts(values)
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy and accounts:
+        return _check_numpy(accounts, ranges)
+    return _check_python(accounts, ranges)
+
+
+def validate_accounts(values, ranges=CARD_RANGES, use_numpy=None):
+    """
+    Returns a mask that is True for each `acct` value that passed all of
+    the checks in `check_accounts`.
+    """
+    codes = check_accounts(values, ranges, use_numpy)
+    if numpy is not None and isinstance(codes, numpy.ndarray):
+        return codes == VALID
+    return [code == VALID for code in codes]
+
+
+def partition_cards(credit_cards, ranges=CARD_RANGES, use_numpy=None):
+    """
+    Splits a sequence of `CreditCard` objects into a list of those whose
+    account numbers pass the checks and a list of those that do not.
+    """
+    credit_cards = list(credit_cards)
+    mask = validate_accounts([card.acct for card in credit_cards], ranges, use_numpy)
+    valid, invalid = [], []
+    for card, ok in zip(credit_cards, mask):
+        (valid if ok else invalid).append(card)
+    return (valid, invalid)
@@ -13,8 +13,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from copy import deepcopy
-import re
+import keyword
+
+_MISSING = object()
 
 class ValidationError(Exception):
     def __init__(self, message):
@@ -47,23 +48,243 @@ class Field(object):
         if self.required and self.value is None:
             raise ValidationError("Required Field")
             
+def normalize_account(value):
+    """
+    Removes whitespace and dashes from a card number string. Other values
+    are returned unchanged.
+    """
+    if isinstance(value, str):
+        if value.isdigit():
+            return value
+        return ''.join(value.split()).replace('-', '')
+    else:
+        return value
+
 class CreditCardField(Field):
     def clean(self, value):
-        try:
-            classinfo = basestring
-        except NameError:
-            classinfo = str
-
-        if isinstance(value, classinfo):
-            return re.sub(r'-', '', re.sub(r'\s', '', value))
-        else:
-            return value
+        return normalize_account(value)
                 
+# Values of the `data_filter` class attribute, which selects the fields
+# included in an object's `data` dictionary.
+TRUTHY = 'truthy' # Fields with a true value (the default)
+TRUTHY_OR_ZERO = 'truthy_or_zero' # Fields with a true value, or equal to zero
+ALL = 'all' # Every field
+
+_DATA_CONDITIONS = {
+    TRUTHY: 'v',
+    TRUTHY_OR_ZERO: 'v == 0 or v',
+    ALL: 'True',
+}
+
+def _is_plain_field(field):
+    """
+    Returns True if `field` stores and validates its value exactly as
+    `Field` does, so generated code may read its `_value` directly.
+    """
+    klass = field.__class__
+    return (klass.value is Field.value and klass.clean is Field.clean
+            and klass.is_valid is Field.is_valid)
+
+def _value_source(var, field):
+    if _is_plain_field(field):
+        return ['v = %s._value' % var, 'if v is None: v = %s.default' % var]
+    return ['v = %s.value' % var]
+
+def _compile(name, lines, namespace):
+    exec('\n'.join(lines), namespace)
+    function = namespace[name]
+    function._generated = True
+    return function
+
+def _generate_init(fields):
+    """
+    Generates an `__init__` that copies each of the class' fields and sets
+    the keyword arguments named after them, without looping over the
+    fields or the arguments.
+    """
+    namespace = dict(_new=object.__new__, _MISSING=_MISSING)
+    params, body = [], []
+    for i, (name, field) in enumerate(fields.items()):
+        namespace['_c%d' % i] = field.__class__
+        namespace['_d%d' % i] = field.__dict__
+        params.append('%s=_MISSING' % name)
+        body.extend([
+            '    _f%d = _new(_c%d)' % (i, i),
+            '    _f%d.__dict__.update(_d%d)' % (i, i),
+            '    _fields[%r] = _f%d' % (name, i),
+        ])
+    lines = ['def __init__(self, data={}, %s**kwargs):' % ''.join(
+                 ['*, ' if params else ''] + [p + ', ' for p in params]),
+             "    self.__dict__['_errors'] = None",
+             "    _fields = self.__dict__['fields'] = {}"]
+    lines.extend(body)
+    lines.extend([
+        '    for _key, _value in data.items():',
+        '        _fields[_key].value = _value',
+        '    for _key in kwargs:',
+        '        raise TypeError("__init__() got an unexpected keyword argument \'%s\'" % _key)',
+    ])
+    for i, (name, field) in enumerate(fields.items()):
+        lines.append('    if %s is not _MISSING:' % name)
+        if _is_plain_field(field):
+            lines.append('        _f%d._value = %s' % (i, name))
+        else:
+            lines.append('        _f%d.value = %s' % (i, name))
+    return _compile('__init__', lines, namespace)
+
+def _generate_get_data(fields, data_filter):
+    """Generates a `_get_data` that tests each field in turn."""
+    condition = _DATA_CONDITIONS[data_filter]
+    lines = ['def _get_data(self):',
+             "    fields = self.__dict__['fields']",
+             '    data = {}']
+    for name, field in fields.items():
+        lines.append('    f = fields[%r]' % name)
+        lines.extend(['    ' + line for line in _value_source('f', field)])
+        if condition == 'True':
+            lines.append('    data[%r] = v' % name)
+        else:
+            lines.append('    if %s: data[%r] = v' % (condition, name))
+    lines.append('    return data')
+    return _compile('_get_data', lines, {})
+
+def _generate_getitem(data_filter):
+    """Generates a `__getitem__` that reads one field rather than all of `data`."""
+    condition = _DATA_CONDITIONS[data_filter]
+    lines = ['def __getitem__(self, key):',
+             "    v = self.__dict__['fields'][key].value"]
+    if condition != 'True':
+        lines.append('    if not (%s): raise KeyError(key)' % condition)
+    lines.append('    return v')
+    return _compile('__getitem__', lines, {})
+
+def _generate_is_valid(fields):
+    """Generates an `is_valid` that only checks the required fields."""
+    namespace = dict(ValidationError=ValidationError)
+    lines = ['def is_valid(self):',
+             "    fields = self.__dict__['fields']",
+             '    errors = {}']
+    for name, field in fields.items():
+        if _is_plain_field(field):
+            if field.required:
+                lines.extend([
+                    '    f = fields[%r]' % name,
+                    '    if f._value is None and f.default is None:',
+                    "        errors[%r] = 'Required Field'" % name])
+        else:
+            lines.extend([
+                '    try:',
+                '        fields[%r].is_valid()' % name,
+                '    except ValidationError as e:',
+                '        errors[%r] = e.message' % name])
+    lines.append("    self.__dict__['_errors'] = errors")
+    return _compile('is_valid', lines, namespace)
+
+def _is_identifier(name):
+    # Field names become keyword parameters of the generated __init__
+    return name.isidentifier() and name.isascii() and not name.startswith('_') \
+        and not keyword.iskeyword(name) and name not in ('self', 'data', 'kwargs')
+
+_field_names = {}
+
+def field_names(klass):
+    """Returns the sorted names of a class' fields, as a tuple."""
+    names = _field_names.get(klass)
+    if names is None:
+        names = _field_names[klass] = tuple(sorted(klass.base_fields))
+    return names
+
+def restore_object(klass, names, values):
+    """
+    Creates an object of `klass` with the raw values of the named fields,
+    as already cleaned by the fields when they were first set.
+    """
+    obj = klass()
+    fields = obj.__dict__['fields']
+    for name, value in zip(names, values):
+        if value is not None:
+            fields[name]._value = value
+    return obj
+
+def _generate_methods(klass):
+    """
+    Replaces the deferred methods of `klass` with implementations
+    specialised to its fields.
+    """
+    deferred = klass.__dict__.get('_deferred_methods')
+    if not deferred:
+        return
+    fields = klass.base_fields
+    if '__init__' in deferred:
+        if all(map(_is_identifier, fields)):
+            klass.__init__ = _generate_init(fields)
+        else:
+            klass.__init__ = PayflowProObjectBase.__init__
+    if '_get_data' in deferred:
+        klass._get_data = _generate_get_data(fields, klass.data_filter)
+        klass.data = property(klass._get_data)
+    if '__getitem__' in deferred:
+        klass.__getitem__ = _generate_getitem(klass.data_filter)
+    if 'is_valid' in deferred:
+        klass.is_valid = _generate_is_valid(fields)
+    klass._deferred_methods = ()
+
+def _deferred(klass, attr):
+    """
+    Returns a stand-in for a method of `klass` that generates the class'
+    methods when it is first called, and then calls the generated one.
+    """
+    def method(self, *args, **kwargs):
+        _generate_methods(klass)
+        return getattr(klass, attr)(self, *args, **kwargs)
+    method.__name__ = attr
+    method._generated = True
+    return method
+
 class DeclarativeFieldsMetaclass(type):
+    """
+    Collects a class' `Field` attributes into `base_fields`, and arranges
+    for `__init__`, `data`, `__getitem__` and `is_valid` implementations
+    specialised to those fields to be generated. Methods defined by the
+    class itself, or inherited from a class that defined them, are left
+    alone.
+
+    Generating the methods is deferred until one of them is first called,
+    so that defining the classes, and importing this module, stays cheap.
+    """
     def __new__(cls, name, bases, attrs):
         attrs['base_fields'] = dict([(field_name, attrs.pop(field_name)) for field_name, obj in attrs.copy().items() if isinstance(obj, Field)])
         new_class = super(DeclarativeFieldsMetaclass, cls).__new__(cls, name, bases, attrs)
-        return new_class            
+        new_class._field_set = frozenset(new_class.base_fields)
+
+        def generated(attr):
+            # Only replace the generic implementations or generated ones
+            inherited = getattr(new_class, attr, None)
+            return attr not in attrs and (
+                inherited is getattr(PayflowProObjectBase, attr, None)
+                or getattr(inherited, '_generated', False))
+
+        deferred = []
+        if generated('__init__'):
+            deferred.append('__init__')
+        data = getattr(new_class, 'data', None)
+        if generated('_get_data') and 'data' not in attrs \
+                and getattr(data, 'fget', None) is getattr(new_class, '_get_data'):
+            deferred.append('_get_data')
+            if generated('__getitem__'):
+                deferred.append('__getitem__')
+        elif generated('__getitem__'):
+            # A custom `data` must be read through the generic lookup
+            new_class.__getitem__ = PayflowProObjectBase.__getitem__
+        if generated('is_valid'):
+            deferred.append('is_valid')
+
+        new_class._deferred_methods = tuple(deferred)
+        for attr in deferred:
+            setattr(new_class, attr, _deferred(new_class, attr))
+        if '_get_data' in deferred:
+            new_class.data = property(new_class._get_data)
+        return new_class
             
 class PayflowProObjectBase(object):
     """
@@ -89,9 +310,15 @@ class PayflowProObjectBase(object):
     A class instance is only valid if it contains attribute values for all of the 
     required attributes. You can check the completeness of a class instance by
     calling the `errors` method.
+
+    The `data` dictionary holds the fields selected by `data_filter`: by
+    default only those with a true value.
     """    
+    data_filter = TRUTHY
+
     def __init__(self, data={}, **kwargs):
         self._errors = None
+        from copy import deepcopy
         # base_fields is a class variable rather than instance variable, 
         # deepcopy to allow modification of an instance's fields.
         self.fields = deepcopy(self.base_fields)
@@ -150,16 +377,19 @@ class PayflowProObjectBase(object):
                 field.is_valid()
             except ValidationError as e:
                 self._errors[name] = e.message                
+
+    def __reduce__(self):
+        # Pickle the field values only, not the Field objects holding them.
+        # The names tuple is shared by every object of the class, so pickle
+        # writes it once per dump.
+        names = field_names(self.__class__)
+        fields = self.__dict__['fields']
+        return (restore_object, (self.__class__, names,
+                                 tuple([fields[name]._value for name in names])))
     
-class PayflowProObject(PayflowProObjectBase):
+class PayflowProObject(PayflowProObjectBase, metaclass=DeclarativeFieldsMetaclass):
     pass
 
-body = vars(PayflowProObject).copy()
-body.pop('__dict__', None)
-body.pop('__weakref__', None)
-
-PayflowProObject = DeclarativeFieldsMetaclass(PayflowProObject.__name__, PayflowProObject.__bases__, body)
-
 class CreditCard(PayflowProObject):
     acct = CreditCardField(required=True)
     expdate = Field()
@@ -198,9 +428,7 @@ class Amount(PayflowProObject):
     freightamt = Field()
     taxamt = Field()
 
-    def _get_data(self):
-        return dict([(field, obj.value) for field, obj in self.fields.items()])
-    data = property(_get_data)
+    data_filter = ALL
     
 class Tracking(PayflowProObject):
     comment1 = Field()
@@ -279,10 +507,8 @@ class Profile(PayflowProObject):
     numfailpayments = Field()
     retrynumdays = Field()
     baid = Field()
-    
-    def _get_data(self):
-        return dict([(field, obj.value) for field, obj in self.fields.items() if obj.value ==0 or obj.value])
-    data = property(_get_data)
+
+    data_filter = TRUTHY_OR_ZERO
    
 class Response(PayflowProObject):
     result = Field(required=True)
@@ -345,8 +571,11 @@ class RecurringPayment(PayflowProObject):
 # Recurring Payments are a special kind of response, which may
 # comprise a number of payment records.
 class RecurringPayments(object):
-    def __init__(self, payments):
+    def __init__(self, payments, numbers=None):
         self.payments = payments
+        # The payment number of each payment, as given by the suffix of its
+        # P_RESULTn parameter; numbered from 1 if not known
+        self.numbers = numbers
     
     def __len__(self):
         return len(self.payments)
@@ -354,13 +583,105 @@ class RecurringPayments(object):
     def __iter__(self):
         return self.payments.__iter__()
 
+    def numbered(self):
+        """Returns a list of `(payment_number, payment)` tuples."""
+        numbers = self.numbers or range(1, len(self.payments) + 1)
+        return list(zip(numbers, self.payments))
+
+    def __reduce__(self):
+        return (RecurringPayments, (self.payments, self.numbers))
+
+
+def _invalidating(method):
+    def wrapper(self, *args, **kwargs):
+        self._classes = self._fields = None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+class ResultSet(list):
+    """
+    The list of PayflowProObjects produced by `parse_parameters`, with
+    lookups that do not rescan the list:
+
+        results[Response]       # First object of a class, or KeyError
+        results.get(Address)    # First object of a class, or None
+        results.pnref           # Value of a field, from the first object having it
+
+    As with `find_class_in_list`, classes are matched exactly rather than
+    with `isinstance`. The response data that no class consumed is
+    available as `unconsumed_data`, and details of the request that
+    produced the results, such as the timings of each attempt, as
+    `metadata`.
+    """
+    def __init__(self, objects=(), unconsumed_data=None, metadata=None):
+        list.__init__(self, objects)
+        self.unconsumed_data = {} if unconsumed_data is None else unconsumed_data
+        self.metadata = {} if metadata is None else metadata
+        self._classes = None
+        self._fields = None
+
+    def _build_index(self):
+        classes, fields = {}, {}
+        for obj in self:
+            if obj is None:
+                continue
+            classes.setdefault(obj.__class__, obj)
+            for name, field in getattr(obj, 'fields', {}).items():
+                # Prefer the first object that has a value for the field
+                if name not in fields or (field.value is not None and
+                        fields[name].fields[name].value is None):
+                    fields[name] = obj
+        self._classes, self._fields = classes, fields
+
+    def get(self, klass, default=None):
+        if self._classes is None:
+            self._build_index()
+        return self._classes.get(klass, default)
+
+    def __getitem__(self, key):
+        if isinstance(key, type):
+            obj = self.get(key)
+            if obj is None:
+                raise KeyError(key)
+            return obj
+        return list.__getitem__(self, key)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if self._fields is None:
+            self._build_index()
+        try:
+            return self._fields[attr].fields[attr].value
+        except KeyError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (
+                self.__class__.__name__, attr))
+
+    def __reduce__(self):
+        return (self.__class__, (list(self), self.unconsumed_data, self.metadata))
+
+    # Changing the list invalidates the lookup indexes
+    __setitem__ = _invalidating(list.__setitem__)
+    __delitem__ = _invalidating(list.__delitem__)
+    __iadd__ = _invalidating(list.__iadd__)
+    append = _invalidating(list.append)
+    extend = _invalidating(list.extend)
+    insert = _invalidating(list.insert)
+    remove = _invalidating(list.remove)
+    pop = _invalidating(list.pop)
+    sort = _invalidating(list.sort)
+    reverse = _invalidating(list.reverse)
+    clear = _invalidating(list.clear)
+    __imul__ = _invalidating(list.__imul__)
+
 
 # Parse results dictionary into a set of PayflowProObjects
 def parse_parameters(payflowpro_response_data):
     """
     Parses a set of Payflow Pro response parameter name and value pairs into 
-    a list of PayflowProObjects, and returns a tuple containing the object
-    list and a dictionary containing any unconsumed data. 
+    a `ResultSet` of PayflowProObjects, and returns a tuple containing the
+    result set and a dictionary containing any unconsumed data. 
     
     The first item in the object list will always be the Response object, and
     the RecurringPayments object (if any) will be last.
@@ -369,8 +690,7 @@ def parse_parameters(payflowpro_response_data):
     indicates an error or oversight in the PayflowProObject definitions.
     """
     def build_class(klass, unconsumed_data):
-        known_att_names_set = set(klass.base_fields.keys())
-        available_atts_set = known_att_names_set.intersection(unconsumed_data)
+        available_atts_set = klass._field_set.intersection(unconsumed_data)
         if available_atts_set:
             available_atts = dict()
             for name in available_atts_set:
@@ -383,7 +703,7 @@ def parse_parameters(payflowpro_response_data):
 
     # Parse the response data first
     response = build_class(Response, unconsumed_data)
-    result_objects = [response]
+    result_objects = ResultSet([response], unconsumed_data)
     
     # Parse the remaining data
     for klass in object.__class__.__subclasses__(PayflowProObject):
@@ -393,12 +713,10 @@ def parse_parameters(payflowpro_response_data):
     
     # Special handling of RecurringPayments
     payments = []
-    payment_id_patt = re.compile(r'p_result(\d+)')
     payment_ids = []
     for k in unconsumed_data:
-        m = payment_id_patt.match(k)
-        if m:
-            payment_ids.append(int(m.group(1)))
+        if k.startswith('p_result') and k[8:].isdigit():
+            payment_ids.append(int(k[8:]))
     payment_ids.sort()
 
     for p_count in payment_ids:
@@ -410,6 +728,6 @@ def parse_parameters(payflowpro_response_data):
             p_transtime = unconsumed_data.pop("p_transtime%d" % p_count, None),
             p_amt = unconsumed_data.pop("p_amt%d" % p_count, None)))
     if payments:
-        result_objects.append(RecurringPayments(payments=payments))
+        result_objects.append(RecurringPayments(payments=payments, numbers=payment_ids))
         
     return (result_objects, unconsumed_data,)
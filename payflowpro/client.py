@@ -19,20 +19,11 @@ limitations under the License.
 """
 
 import sys
+import threading
 import time
-import re
 import types
-import logging
-
-try:
-    from urllib.parse import urlsplit
-    from urllib.request import urlopen
-    from urllib.request import Request
-except ImportError:
-    from urllib2 import Request
-    from urllib2 import urlopen
-    from urllib2 import urlparse
-    urlsplit = urlparse.urlsplit
+
+from contextlib import nullcontext
 
 from .classes import Address
 from .classes import Amount
@@ -40,7 +31,18 @@ from .classes import CreditCard
 from .classes import parse_parameters
 from .classes import Profile
 from .classes import Response
+from .classes import ResultSet
 from .classes import Tracking
+from .deadline import as_deadline
+from .deadline import DeadlineExceeded
+from .dispatch import Dispatcher
+from .endpoints import EndpointPool
+from .parmlist import ParmlistParser
+from .parmlist import ResponseTooLarge
+from .preflight import check as check_preflight
+from .preflight import PreflightError
+from .transport import AttemptTimings
+from .transport import Transport
 
 """
 TENDER_TYPES:
@@ -64,10 +66,51 @@ TRANSACTION_TYPES:
 """
 
 
+class _Logger(object):
+    """
+    A logger attribute that is only looked up, importing `logging`, when it
+    is first used, which keeps importing this module cheap.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.attr = '_logger_' + name.replace('.', '_')
+
+    def __get__(self, obj, klass=None):
+        if obj is None:
+            return self
+        logger = obj.__dict__.get(self.attr)
+        if logger is None:
+            import logging
+            logger = obj.__dict__[self.attr] = logging.getLogger(self.name)
+        return logger
+
+    def __set__(self, obj, logger):
+        obj.__dict__[self.attr] = logger
+
+
 class CurrentTimeIdGenerator(object):
+    """
+    Generates request IDs from the current time in milliseconds. Calls made
+    in the same millisecond get consecutive IDs, so no two IDs from one
+    generator are the same; generators in different processes may still
+    produce the same ID.
+    """
+    def __init__(self):
+        self._last = 0
+        self._lock = threading.Lock()
+
     def id(self):
         """Returns the current time in milliseconds as an integer."""
-        return int(time.time() * 1000) # Current time in milliseconds
+        with self._lock:
+            self._last = max(int(time.time() * 1000), self._last + 1)
+            return self._last
+
+
+class RandomIdGenerator(object):
+    def id(self):
+        """Returns a random 32 character hexadecimal string."""
+        import uuid
+        return uuid.uuid4().hex
 
 
 class PayflowProClient(object):
@@ -85,23 +128,63 @@ class PayflowProClient(object):
     API_VERSION = '4'
     CLIENT_IDENTIFIER = 'python-payflowpro'
     MAX_RETRY_COUNT = 5 # How many times to retry failed logins or rate limited operations
+    MAX_CONCURRENCY = 4 # How many background calls may be in flight at once
+    MAX_RESPONSE_BYTES = 2 * 1024 * 1024 # Largest response accepted
+
+    log = _Logger('payflow_pro')
+    slow_log = _Logger('payflow_pro.slow')
     
     def __init__(self, partner, vendor, username, password, timeout_secs=45,
-        idgenerator=CurrentTimeIdGenerator(), url_base=URL_BASE_TEST):
+        idgenerator=RandomIdGenerator(), url_base=URL_BASE_TEST,
+        max_concurrency=None, archive=None, hedging=None,
+        transport=None, slow_call_threshold=None, concurrency_limit=None,
+        preflight=False, duplicates=None, endpoints=None, redirect=None,
+        max_response_bytes=MAX_RESPONSE_BYTES):
         
         self.partner = partner
         self.vendor = vendor
         self.username = username
         self.password = password
         self.timeout = timeout_secs
-        self.url_base = url_base
         self.idgenerator = idgenerator
-        self.log = logging.getLogger('payflow_pro')
-
-        if self.url_base == self.URL_BASE_TEST:
+        # Direct calls only wait for a dispatcher slot if a limit was asked
+        # for; background calls always run in at most `max_concurrency`
+        self.limit_direct_calls = max_concurrency is not None \
+            or concurrency_limit is not None
+        self.dispatcher = Dispatcher(max_concurrency or self.MAX_CONCURRENCY,
+            limit=concurrency_limit)
+        self.archive = archive
+        self.hedging = hedging
+        self.transport = transport or Transport()
+        self.slow_call_threshold = slow_call_threshold
+        self.preflight = preflight
+        self.duplicates = duplicates
+        self.max_response_bytes = max_response_bytes
+
+        # Requests are sent to `url_base`, or routed across `endpoints`, in
+        # which case `url_base` is the first of them. Whether those are live
+        # or test endpoints can't be told from their URLs, so the Express
+        # Checkout redirect must be given with them.
+        if endpoints is None:
+            endpoints = [url_base]
+        elif redirect is None:
+            raise ValueError('A redirect is required with endpoints')
+        if not isinstance(endpoints, EndpointPool):
+            endpoints = EndpointPool(endpoints)
+        self.endpoints = endpoints
+        self.url_base = endpoints.endpoints[0].url
+
+        if redirect is not None:
+            self.redirect = redirect
+        elif self.url_base == self.URL_BASE_TEST:
             self.redirect = self.REDIRECT_TEST
         else:
             self.redirect = self.REDIRECT_LIVE
+
+    def _get_concurrency_limit(self):
+        """The number of calls that may be in flight at the moment."""
+        return self.dispatcher.capacity()
+    concurrency_limit = property(_get_concurrency_limit)
         
     def _build_parmlist(self, parameters):
         """
@@ -116,12 +199,7 @@ class PayflowProClient(object):
                 # We always use the explicit-length keyname format, to reduce the chance
                 # of requests failing due to unusual characters in parameter values.
 
-                try:
-                    classinfo = unicode
-                except NameError:
-                    classinfo = str
-
-                if isinstance(value, classinfo):
+                if isinstance(value, str):
                     key = '%s[%d]' % (key.upper(), len(value.encode('utf-8')))
                 else:
                     key = '%s[%d]' % (key.upper(), len(str(value)))
@@ -130,52 +208,44 @@ class PayflowProClient(object):
         parmlist = '&'.join(args)        
         return parmlist
     
+    def _combine(self, params, objects, extras=()):
+        """
+        Adds the data of each object, and of each of the `extras`, to the
+        `params` dictionary. In pre-flight mode, the combined parameters
+        are then checked, and so are the required fields of `objects`, the
+        objects the transaction sends in full; `extras` may hold partial
+        objects, such as the changes made by a profile modification.
+        Raises `PreflightError` if the gateway would reject them.
+        """
+        for item in list(objects) + list(extras):
+            params.update(item.data)
+        if self.preflight:
+            check_preflight(params, objects)
+        return params
+
     def _parse_parmlist(self, parmlist):
         """
-        Parses a PARMLIST string into a dictionary of name and value 
-        pairs. The parsing is complicated by the following:
-        
-         - parameter keynames may or may not include a length 
-           specification
-         - delimiter characters (=, &) may appear inside parameter
-           values, provided the parameter has an explicit length.
-        
-        For example, the following parmlist values are possible:
-        
-          A=B&C=D
-          A[1]=B&C[1]=D
-          A=B&C[1]=D
-          A[3]=B&B&C[1]=D  (Here, the value of A is "B&B")
-          A[1]=B&C[3]=D=7  (Here, the value of C is "D=7")
-          
+        Parses a PARMLIST string into a dictionary of name and value
+        pairs. See `parse_parmlist`.
         """
-        parmlist = "&" + parmlist
-        name_re = re.compile(r'\&([A-Z0-9_]+)(\[\d+\])?=')
-        
-        results = {}
-        offset = 0
-        match = name_re.search(parmlist, offset)
-        while match:
-            name, len_suffix = match.groups()
-            offset = match.end()
-            if len_suffix:
-                val_len = int(len_suffix[1:-1])
-            else:
-                next_match = name_re.search(parmlist, offset)
-                if next_match:
-                    val_len = next_match.start() - match.end()
-                else:
-                    # At end of parmlist
-                    val_len = len(parmlist) - match.end()
-            value = parmlist[match.end() : match.end() + val_len]
-            results[name.lower()] = value
-                                    
-            match = name_re.search(parmlist, offset)
-        return results        
-
-    def _do_request(self, request_id, parameters={}):
+        return parse_parmlist(parmlist)
+
+    def _do_request(self, request_id, parameters={}, deadline=None, priority=None):
         """
+        Sends a request to the gateway, retrying failed attempts, and
+        returns the parsed `(result_objects, unconsumed_data)` tuple.
+
+        Each attempt is limited to `timeout_secs`, or to the time left
+        before `deadline` if that is sooner; no attempt is made once the
+        deadline has passed. With `limit_direct_calls`, the request waits
+        for a slot in the dispatcher's lane for `priority` before it is
+        sent.
+
+        Each attempt goes to the endpoint chosen by `endpoints`. An
+        endpoint that failed is avoided for the rest of the request, and
+        every attempt carries the same request ID.
         """
+        deadline = as_deadline(deadline)
         if request_id is None:
             # Generate a new request identifier using the class' default generator
             request_id = self.idgenerator.id()
@@ -191,7 +261,6 @@ class PayflowProClient(object):
         parmlist = self._build_parmlist(req_params)
         
         headers = {
-            'Host': urlsplit(self.url_base)[1],
             'X-VPS-REQUEST-ID': str(request_id),
             'X-VPS-CLIENT-TIMEOUT': str(self.timeout), # Doc says to do this
             'X-VPS-Timeout': str(self.timeout), # Example says to do this
@@ -206,205 +275,405 @@ class PayflowProClient(object):
             
         try_count = 0
         results = None
-        while (results is None and try_count < self.MAX_RETRY_COUNT):
-            try:
-                try_count += 1
-                request = Request(
-                    url = self.url_base, 
-                    data = parmlist.encode('utf-8'), 
-                    headers = headers)
-                    
-                response = urlopen(request)
-                result_parmlist = response.read().decode('utf-8')
-                response.close()
+        attempts = []
+        failed_endpoints = set()
+        started = time.monotonic()
+        # Waits for a slot in the priority lane, unless this thread has one
+        slot = nullcontext()
+        if self.limit_direct_calls:
+            slot = self.dispatcher.slot(priority, deadline)
+        with slot:
+            while (results is None and try_count < self.MAX_RETRY_COUNT):
+                timeout = self.timeout
+                if deadline is not None:
+                    # Raises DeadlineExceeded if there is no time left
+                    timeout = deadline.timeout(self.timeout)
+                    headers['X-VPS-CLIENT-TIMEOUT'] = headers['X-VPS-Timeout'] = \
+                        str(max(int(timeout), 1))
+                endpoint = self.endpoints.choose(exclude=failed_endpoints)
+                headers['Host'] = endpoint.host
+                try:
+                    try_count += 1
+                    timings = AttemptTimings(endpoint.url)
+                    attempts.append(timings)
+                    if self.hedging is None:
+                        parser = self._send(endpoint.url, parmlist, headers,
+                            timeout, timings)
+                    else:
+                        # Each copy is timed separately; the winner's timings are
+                        # kept. The losing copy may outlive this attempt, until
+                        # it is cancelled, so it gets its own copy of the
+                        # headers. A hedge starts later than the first copy, so
+                        # it only gets the time left.
+                        def send(url=endpoint.url, attempt_headers=dict(headers),
+                                 cancellation=None):
+                            headers = dict(attempt_headers)
+                            timeout = self.timeout
+                            if deadline is not None:
+                                timeout = deadline.timeout(self.timeout)
+                                headers['X-VPS-CLIENT-TIMEOUT'] = headers['X-VPS-Timeout'] = \
+                                    str(max(int(timeout), 1))
+                            timings = AttemptTimings(url)
+                            try:
+                                return (self._send(url, parmlist, headers, timeout,
+                                    timings, cancellation), timings)
+                            except Exception as e:
+                                # Keeps the timings of a failed copy for the
+                                # attempt's record
+                                e.timings = timings
+                                raise
+                        parser, attempts[-1] = self.hedging.run(send)
                 
-                self.log.debug(
-                    u'Result text: %s' % result_parmlist
-                )
+                    if parser.text is not None:
+                        self.log.debug(
+                            u'Result text: %s' % parser.text
+                        )
                 
-                results = self._parse_parmlist(result_parmlist)
-            except Exception as e:
+                    results = parser.results
+                    self.dispatcher.observe(attempts[-1].total, True)
+                    self.endpoints.record_success(endpoint, attempts[-1].total)
+                    if self.archive is not None:
+                        self._archive_exchange(request_id, parmlist,
+                            parser.text, results.get('pnref'))
+                except ResponseTooLarge as e:
+                    # The endpoint did answer, and would send the same
+                    # response again, so this is neither retried nor counted
+                    # as a failure
+                    self.log.exception(u'API request failed - %s', e)
+                    raise
+                except Exception as e:
                 
-                if try_count < self.MAX_RETRY_COUNT:
-                    self.log.warn(
-                        u'API request attempt %s of %s failed - %%s' % (
-                            try_count, self.MAX_RETRY_COUNT), e
-                        )
-                else:
-                    self.log.exception(u'Final API request failed - %s', e)
-                    raise e
+                    if getattr(e, 'timings', None) is not None:
+                        attempts[-1] = e.timings
+                    if attempts[-1].error is None:
+                        attempts[-1].error = u'%s: %s' % (e.__class__.__name__, e)
+                    self.dispatcher.observe(attempts[-1].total, False)
+                    # An attempt that never connected certainly wasn't processed
+                    self.endpoints.record_failure(endpoint,
+                        connected=attempts[-1].connected)
+                    failed_endpoints.add(endpoint)
+                    if deadline is not None and deadline.expired():
+                        self.log.exception(u'API request attempt %s failed at deadline - %s',
+                            try_count, e)
+                        raise DeadlineExceeded(
+                            u'Deadline exceeded after %s attempts - %s' % (try_count, e),
+                            deadline)
+                    elif try_count < self.MAX_RETRY_COUNT:
+                        self.log.warning(
+                            u'API request attempt %s of %s failed - %%s' % (
+                                try_count, self.MAX_RETRY_COUNT), e
+                            )
+                    else:
+                        self.log.exception(u'Final API request failed - %s', e)
+                        raise e
         
         self.log.debug(u'Parsed PARMLIST: %s' % results)
         
         # Parse results dictionary into a set of PayflowProObjects
         result_objects, unconsumed_data = parse_parameters(results)
 
+        result_objects.metadata = metadata = dict(
+            request_id = request_id,
+            attempts = attempts,
+            elapsed = time.monotonic() - started,
+        )
+        if self.slow_call_threshold is not None \
+                and metadata['elapsed'] >= self.slow_call_threshold:
+            self._log_slow_call(request_id, parameters, metadata)
+
         self.log.debug(u'Result parsed objects: %s' % result_objects)
         self.log.debug(u'Unconsumed Data: %s' % unconsumed_data)
 
         return (result_objects, unconsumed_data)
     
     
+    def _do_payment_request(self, request_id, parameters, deadline=None, priority=None):
+        """
+        Like `_do_request`, but with a `duplicates` suppressor, a payment
+        that repeats a recent one returns the original result instead.
+        """
+        if self.duplicates is None:
+            return self._do_request(request_id, parameters, deadline=deadline,
+                priority=priority)
+        deadline = as_deadline(deadline)
+        return self.duplicates.run(parameters, deadline, self._do_request,
+            request_id, parameters, deadline=deadline, priority=priority)
+
+    def _send(self, url, parmlist, headers, timeout, timings, cancellation=None):
+        """
+        Makes a single attempt at a request to `url` and returns the
+        `ParmlistParser` the response was parsed with as it was read,
+        recording the time taken by each phase in `timings`. Raises
+        `ResponseTooLarge` if the response exceeds `max_response_bytes`.
+        A `cancellation` can abort the attempt from another thread.
+
+        The raw response text is only kept, as the parser's `text`, when
+        it is needed for the archive or for debug logging.
+        """
+        import logging
+        keep_text = self.archive is not None or self.log.isEnabledFor(logging.DEBUG)
+        parser = ParmlistParser(self.max_response_bytes, keep_text=keep_text)
+        self.transport.send(url, parmlist.encode('utf-8'),
+            headers, timeout, timings, parser=parser, cancellation=cancellation)
+        return parser
+
+    def _log_slow_call(self, request_id, parameters, metadata):
+        lines = [u'Slow call: request %s (%s/%s) took %.3fs in %d attempts' % (
+            request_id, parameters.get('trxtype'), parameters.get('action'),
+            metadata['elapsed'], len(metadata['attempts']))]
+        for i, timings in enumerate(metadata['attempts']):
+            lines.append(u'  attempt %d: %s' % (i + 1, timings))
+        self.slow_log.warning(u'\n'.join(lines))
+
+    def _archive_exchange(self, request_id, parmlist, result_parmlist, pnref):
+        # A failure to archive must not fail the transaction
+        try:
+            self.archive.record(request_id, parmlist, result_parmlist, pnref)
+        except Exception as e:
+            self.log.exception(u'Failed to archive request %s - %s', request_id, e)
+
+    ##### Batch and asynchronous calls #####
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Calls the named transaction method in the background and returns a
+        `concurrent.futures.Future` for its `(result_objects,
+        unconsumed_data)` tuple. A relative `deadline` keyword argument is
+        measured from the time of submission, not from when the call starts.
+        The call is queued in the lane for its `priority` keyword argument.
+        """
+        if kwargs.get('deadline') is not None:
+            kwargs['deadline'] = as_deadline(kwargs['deadline'])
+        if method.startswith('_'):
+            raise ValueError("'%s' is not a transaction method" % method)
+        return self.dispatcher.schedule(kwargs.get('priority'),
+            getattr(self, method), *args, **kwargs)
+
+    def batch(self, calls, return_exceptions=False, deadline=None, priority=None):
+        """
+        Runs a sequence of `(method, args)` or `(method, args, kwargs)`
+        tuples concurrently and returns their results in the same order.
+        If `return_exceptions` is true, a call that raised an exception has
+        the exception in its place; otherwise the first one is re-raised.
+        A `deadline` and `priority` apply to every call that does not have
+        its own.
+        """
+        deadline = as_deadline(deadline)
+        futures = []
+        for call in calls:
+            method, args, kwargs = (tuple(call) + ({},))[:3]
+            if deadline is not None and kwargs.get('deadline') is None:
+                kwargs = dict(kwargs, deadline=deadline)
+            if priority is not None and kwargs.get('priority') is None:
+                kwargs = dict(kwargs, priority=priority)
+            futures.append(self.submit(method, *args, **kwargs))
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def call_async(self, method, *args, **kwargs):
+        """
+        Like `submit`, but returns an `asyncio` future that can be awaited
+        from a coroutine running in the current event loop.
+        """
+        import asyncio
+        return asyncio.wrap_future(self.submit(method, *args, **kwargs))
+
     ##### Implementations of standard transactions #####
     
-    def sale(self, credit_card, amount, request_id=None, extras=[]):        
+    def sale(self, credit_card, amount, request_id=None, extras=[], deadline=None, priority=None):        
         params = dict(trxtype = "S")
-        for item in [credit_card, amount] + extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [credit_card, amount], extras)
+        return self._do_payment_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def authorization(self, credit_card, amount, request_id=None, extras=[]):        
+    def authorization(self, credit_card, amount, request_id=None, extras=[], deadline=None, priority=None):        
         params = dict(trxtype = "A")
-        for item in [credit_card, amount] + extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [credit_card, amount], extras)
+        return self._do_payment_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def capture(self, auth_pnref, request_id=None, extras=[]):        
+    def capture(self, auth_pnref, request_id=None, extras=[], deadline=None, priority=None):        
         params = dict(trxtype = "D", origid = auth_pnref)
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def voice_authorization(self, voice_auth_code, credit_card, amount, request_id=None, extras=[]):
+    def voice_authorization(self, voice_auth_code, credit_card, amount, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = "F", authcode = voice_auth_code)
-        for item in [credit_card, amount] + extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [credit_card, amount], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def credit_referenced(self, original_pnref, request_id=None, extras=[]):
+    def credit_referenced(self, original_pnref, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = "C", origid = original_pnref)
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def credit_unreferenced(self, credit_card, amount, request_id=None, extras=[]):
+    def credit_unreferenced(self, credit_card, amount, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = "C")
-        for item in [credit_card, amount] + extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [credit_card, amount], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def void(self, original_pnref, request_id=None, extras=[]):
+    def void(self, original_pnref, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = "V", origid = original_pnref)
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def inquiry(self, original_pnref=None, customer_ref=None, request_id=None, extras=[]):
+    def inquiry(self, original_pnref=None, customer_ref=None, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = "I", origid = original_pnref, custref = customer_ref)
         if original_pnref is None and customer_ref is None:
             raise TypeError("An inquiry requires one of the 'original_pnref' or 'customer_ref' arguments")
         if not original_pnref is None and not customer_ref is None:
             raise TypeError("An inquiry requires only one of the 'original_pnref' or 'customer_ref' arguments, not both")
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def reference_transaction(self, transaction_type, original_pnref, amount, request_id=None, extras=[]):
+    def reference_transaction(self, transaction_type, original_pnref, amount, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = transaction_type, origid = original_pnref)
-        for item in [amount] + extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [amount], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def reference_transaction_baid(self, transaction_type, baid, amount, request_id=None, extras=[]):
+    def reference_transaction_baid(self, transaction_type, baid, amount, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = transaction_type, baid = baid,tender='P',
                       action='D')
-        for item in [amount] + extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [amount], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
     ##### Implementations of paypal express checkout #####
 
-    def set_checkout(self, setpaypal, amount, extras=[]):        
+    def set_checkout(self, setpaypal, amount, extras=[], request_id=None, deadline=None, priority=None):
         params = dict(trxtype = "S", action = "S")
-        for item in [setpaypal, amount] + extras:
-            params.update(item.data)
-        return self._do_request(None, params)
+        self._combine(params, [setpaypal, amount], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
         
-    def baid_set_checkout(self, setpaypal, amount, extras=[]):
+    def baid_set_checkout(self, setpaypal, amount, extras=[], request_id=None, deadline=None, priority=None):
         params = dict(trxtype = "A", action = "S")
-        for item in [setpaypal, amount] + extras:
-           params.update(item.data)
-        return self._do_request(None, params)
+        self._combine(params, [setpaypal, amount], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
       
-    def get_baid(self, token):
+    def get_baid(self, token, request_id=None, deadline=None, priority=None):
         params = dict(trxtype = "A", action = "X", tender = "P",
                        token = token)
-        return self._do_request(None, params)
+        self._combine(params, [])
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def get_checkout(self, getpaypal, extras=[]):
+    def get_checkout(self, getpaypal, extras=[], request_id=None, deadline=None, priority=None):
         params = dict(trxtype = "S", action = "G")
-        for item in [getpaypal] + extras:
-            params.update(item.data)
-        return self._do_request(None, params)
+        self._combine(params, [getpaypal], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def do_checkout(self, dopaypal, amount, extras=[]):
+    def do_checkout(self, dopaypal, amount, extras=[], request_id=None, deadline=None, priority=None):
         params = dict(trxtype = "S", action = "D")
-        for item in [dopaypal, amount] + extras:
-            params.update(item.data)
-        return self._do_request(None, params)
+        self._combine(params, [dopaypal, amount], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
     ##### Implementations of recurring transactions #####
     
-    def profile_add(self, profile, credit_card, amount, request_id=None, extras=[]):
+    def profile_add(self, profile, credit_card, amount, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = 'R', action = 'A')
-        for item in [profile, credit_card, amount] + extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [profile, credit_card, amount], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def profile_baid_add(self, profile, amount, request_id=None, extras=[]):
+    def profile_baid_add(self, profile, amount, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = 'R', action = 'A', tender = "P")
-        for item in [profile, amount] + extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)
+        self._combine(params, [profile, amount], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)
 
-    def profile_add_from_transaction(self, original_pnref, request_id=None, extras=[]):
+    def profile_add_from_transaction(self, original_pnref, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = 'R', action = 'A', origid = original_pnref)
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)        
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)        
 
-    def profile_modify(self, profile_id, request_id=None, extras=[]):
+    def profile_modify(self, profile_id, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = 'R', action = 'M', origprofileid = profile_id)
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)        
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)        
 
-    def profile_reactivate(self, profile_id, request_id=None, extras=[]):
+    def profile_reactivate(self, profile_id, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = 'R', action = 'R', origprofileid = profile_id)
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)        
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)        
 
-    def profile_cancel(self, profile_id, request_id=None, extras=[]):
+    def profile_cancel(self, profile_id, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = 'R', action = 'C', origprofileid = profile_id)
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)        
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)        
 
-    def profile_inquiry(self, profile_id, payment_history_only=False, request_id=None, extras=[]):
+    def profile_inquiry(self, profile_id, payment_history_only=False, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = 'R', action = 'I', origprofileid = profile_id)
         if payment_history_only:
             params['paymenthistory'] = 'Y'
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)        
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)        
     
-    def profile_pay(self, profile_id, payment_number, request_id=None, extras=[]):
+    def profile_pay(self, profile_id, payment_number, request_id=None, extras=[], deadline=None, priority=None):
         params = dict(trxtype = 'R', action = 'P', 
             origprofileid = profile_id, paymentnum = payment_number)
-        for item in extras:
-            params.update(item.data)
-        return self._do_request(request_id, params)         
+        self._combine(params, [], extras)
+        return self._do_request(request_id, params, deadline=deadline,
+            priority=priority)         
 
 
+def parse_parmlist(parmlist):
+    """
+    Parses a PARMLIST string into a dictionary of name and value 
+    pairs. The parsing is complicated by the following:
+    
+     - parameter keynames may or may not include a length 
+       specification
+     - delimiter characters (=, &) may appear inside parameter
+       values, provided the parameter has an explicit length.
+    
+    For example, the following parmlist values are possible:
+    
+      A=B&C=D
+      A[1]=B&C[1]=D
+      A=B&C[1]=D
+      A[3]=B&B&C[1]=D  (Here, the value of A is "B&B")
+      A[1]=B&C[3]=D=7  (Here, the value of C is "D=7")
+
+    Lengths are counted in UTF-8 bytes, as the gateway counts them. The
+    string is parsed with a `ParmlistParser`.
+    """
+    parser = ParmlistParser()
+    parser.feed(parmlist.encode('utf-8'))
+    return parser.close()
+
 def find_class_in_list(klass, lst):
     """
     Returns the first occurrence of an instance of type `klass` in 
     the given list, or None if no such instance is present.
     """
-    filtered = list(filter(lambda x: x.__class__ == klass, lst))
-    if filtered:
-        return filtered[0]
+    if isinstance(lst, ResultSet):
+        return lst.get(klass)
+    for obj in lst:
+        if obj.__class__ == klass:
+            return obj
     return None
 
 def find_classes_in_list(klasses, lst):
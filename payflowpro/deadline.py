@@ -0,0 +1,78 @@
+"""
+Deadlines bound the total time a transaction may take, across all of its
+attempts.
+
+Every transaction method of `PayflowProClient` accepts a `deadline`
+argument, which is either a `Deadline`, a number of seconds from now, or a
+`datetime`. Each attempt is given the time remaining as its socket timeout
+and as its X-VPS-CLIENT-TIMEOUT, and no further attempt is made once the
+deadline has passed:
+
+    client.sale(credit_card, amount, deadline=10)
+    client.sale(credit_card, amount, deadline=Deadline.at(request_started + 10))
+"""
+import time
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, message, deadline=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.deadline = deadline
+
+
+class Deadline(object):
+    """
+    A point in time after which a call should be abandoned, measured with
+    a monotonic clock so that it is unaffected by changes to the system
+    time.
+    """
+
+    def __init__(self, expires):
+        self.expires = expires
+
+    @classmethod
+    def after(cls, seconds):
+        """A deadline `seconds` from now."""
+        return cls(time.monotonic() + seconds)
+
+    @classmethod
+    def at(cls, timestamp):
+        """A deadline at a `time.time()` timestamp or aware `datetime`."""
+        if hasattr(timestamp, 'timestamp'):
+            timestamp = timestamp.timestamp()
+        return cls.after(timestamp - time.time())
+
+    def remaining(self):
+        """Returns the seconds left before the deadline, which may be negative."""
+        return self.expires - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, limit=None):
+        """
+        Returns the seconds left, capped at `limit`, or raises
+        `DeadlineExceeded` if there are none.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline exceeded by %.3fs' % -remaining, self)
+        if limit is not None and limit < remaining:
+            return limit
+        return remaining
+
+    def __str__(self):
+        return 'Deadline in %.3fs' % self.remaining()
+
+
+def as_deadline(value):
+    """
+    Converts a `deadline` argument into a `Deadline`, or None if there is
+    no deadline. Numbers are relative, in seconds from now.
+    """
+    if value is None or isinstance(value, Deadline):
+        return value
+    if isinstance(value, (int, float)):
+        return Deadline.after(value)
+    return Deadline.at(value)
@@ -0,0 +1,279 @@
+"""
+Schedules `PayflowProClient` calls, both those made directly and those
+run in the background for the client's batch and asynchronous APIs.
+
+Every background call takes one of `max_concurrency` slots while it is
+in flight, and so do calls made directly on a client that was given a
+`max_concurrency` or a `concurrency_limit`; without either, direct calls
+are not limited, as they never were. Calls are queued in priority lanes,
+and free slots are shared between the lanes by weighted fair queuing:
+with the default lanes, interactive calls get eight slots for every four
+normal and one background call. A lane can also have slots reserved for
+it, which no other lane may take, so that a long run of background calls
+cannot keep checkout traffic waiting:
+
+    client = PayflowProClient(..., max_concurrency=8)
+    client.sale(credit_card, amount, priority=INTERACTIVE)
+    client.batch([('profile_inquiry', (profile_id,)) for profile_id in ids],
+                 priority=BACKGROUND)
+
+With a `limit`, such as an `AIMDLimit`, the number of slots adapts to the
+observed latency and failures of the gateway, up to `max_concurrency`.
+"""
+import threading
+
+from collections import deque
+from contextlib import contextmanager
+
+from .deadline import DeadlineExceeded
+
+INTERACTIVE = 'interactive'
+NORMAL = 'normal'
+BACKGROUND = 'background'
+
+
+class Lane(object):
+    """
+    A priority class. `weight` is its share of the slots when several lanes
+    have calls waiting, and `reserved` the number of slots only it may use.
+    """
+
+    def __init__(self, name, weight=1, reserved=0):
+        self.name = name
+        self.weight = weight
+        self.reserved = reserved
+        self.waiting = deque()
+        self.active = 0
+        self.started = 0
+        self.finish = 0.0 # Virtual time at which the lane's last call "ends"
+
+    def __str__(self):
+        return 'Lane %s: %d active, %d waiting' % (
+            self.name, self.active, len(self.waiting))
+
+
+# Highest priority first; reservations are granted in this order
+DEFAULT_LANES = (
+    (INTERACTIVE, 8, 1),
+    (NORMAL, 4, 0),
+    (BACKGROUND, 1, 0),
+)
+
+
+class _Waiter(object):
+    def __init__(self, lane, call=None):
+        self.lane = lane
+        self.call = call
+        self.granted = False
+
+
+class Dispatcher(object):
+    """
+    Lets at most `max_concurrency` calls be in flight at once. Background
+    calls run on a pool of threads, which is only started when the first
+    call is submitted.
+
+    `lanes` is a sequence of `(name, weight, reserved)` tuples, highest
+    priority first. Calls without a priority go in the `default_priority`
+    lane. If `limit` is given, it decides how many of the
+    `max_concurrency` slots may be used at any time.
+    """
+
+    def __init__(self, max_concurrency, lanes=DEFAULT_LANES, default_priority=NORMAL,
+        limit=None):
+
+        self.max_concurrency = max_concurrency
+        self.limit = limit
+        if limit is not None:
+            limit.bind(max_concurrency)
+        self.lanes = [Lane(*lane) for lane in lanes]
+        self._lanes = dict((lane.name, lane) for lane in self.lanes)
+        self.default_priority = default_priority
+        self._lane(default_priority)
+        self._active = 0
+        self._virtual_time = 0.0
+        self._executor = None
+        self._condition = threading.Condition(threading.Lock())
+        # Set while a thread holds a slot, so that nested calls don't wait
+        # for a second one
+        self._local = threading.local()
+
+    def _lane(self, priority):
+        if priority is None:
+            priority = self.default_priority
+        try:
+            return self._lanes[priority]
+        except KeyError:
+            raise ValueError("Unknown priority '%s'" % priority)
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Imported here, as it is only needed by background calls
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix='payflowpro')
+        return self._executor
+
+    ##### Scheduling, with the lock held #####
+
+    def _capacity(self):
+        if self.limit is None:
+            return self.max_concurrency
+        return max(min(self.limit.current(), self.max_concurrency), 1)
+
+    def _reservations(self, capacity):
+        # At least one slot always stays shared, whatever the reservations
+        available = capacity - 1
+        reservations = {}
+        for lane in self.lanes:
+            reservations[lane] = max(min(lane.reserved, available), 0)
+            available -= reservations[lane]
+        return reservations
+
+    def _can_start(self, lane, capacity, reservations):
+        if self._active >= capacity:
+            return False
+        if lane.active < reservations[lane]:
+            return True
+        held = sum(max(reservations[other] - other.active, 0)
+                   for other in self.lanes if other is not lane)
+        return self._active + held < capacity
+
+    def _enqueue(self, waiter):
+        lane = waiter.lane
+        if not lane.waiting:
+            # A lane that was idle doesn't get credit for the time it was idle
+            lane.finish = max(lane.finish, self._virtual_time)
+        lane.waiting.append(waiter)
+        self._schedule()
+
+    def _schedule(self):
+        capacity = self._capacity()
+        reservations = self._reservations(capacity)
+        while True:
+            ready = [lane for lane in self.lanes
+                     if lane.waiting and self._can_start(lane, capacity, reservations)]
+            if not ready:
+                return
+            # Serve the lane whose next call would finish first in virtual
+            # time. min() keeps the first of equals, so ties go to the
+            # higher priority.
+            lane = min(ready, key=lambda lane: lane.finish + 1.0 / lane.weight)
+            waiter = lane.waiting.popleft()
+            self._virtual_time = lane.finish
+            lane.finish += 1.0 / lane.weight
+            lane.active += 1
+            lane.started += 1
+            self._active += 1
+            waiter.granted = True
+            if waiter.call is not None:
+                self._get_executor().submit(self._run, waiter)
+            else:
+                self._condition.notify_all()
+
+    def _release(self, lane):
+        with self._condition:
+            lane.active -= 1
+            self._active -= 1
+            self._schedule()
+
+    def _run(self, waiter):
+        future, fn, args, kwargs = waiter.call
+        self._local.lane = waiter.lane
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self._local.lane = None
+            self._release(waiter.lane)
+
+    ##### Public interface #####
+
+    def schedule(self, priority, fn, /, *args, **kwargs):
+        """
+        Schedules `fn(*args, **kwargs)` in the lane for `priority` and
+        returns a `Future`.
+        """
+        from concurrent.futures import Future
+        lane = self._lane(priority)
+        future = Future()
+        with self._condition:
+            self._enqueue(_Waiter(lane, (future, fn, args, kwargs)))
+        return future
+
+    def submit(self, fn, /, *args, **kwargs):
+        """Schedules `fn(*args, **kwargs)` in the default lane and returns a `Future`."""
+        return self.schedule(None, fn, *args, **kwargs)
+
+    def observe(self, latency, ok):
+        """
+        Feeds the outcome of a gateway attempt that took `latency` seconds
+        to the `limit`, if there is one.
+        """
+        if self.limit is None:
+            return
+        with self._condition:
+            demand = self._active + sum(len(lane.waiting) for lane in self.lanes)
+            self.limit.update(latency, ok, demand)
+            # A higher limit may let waiting calls start
+            self._schedule()
+
+    def capacity(self):
+        """Returns the number of calls that may be in flight at the moment."""
+        with self._condition:
+            return self._capacity()
+
+    def holds_slot(self):
+        """Returns True if the current thread is running a call that holds a slot."""
+        return getattr(self._local, 'lane', None) is not None
+
+    @contextmanager
+    def slot(self, priority=None, deadline=None):
+        """
+        A context manager that waits for a slot in the lane for `priority`
+        and holds it for the duration of the block. Raises
+        `DeadlineExceeded` if `deadline` passes first. Threads that already
+        hold a slot keep using it.
+        """
+        if self.holds_slot():
+            yield
+            return
+        lane = self._lane(priority)
+        waiter = _Waiter(lane)
+        with self._condition:
+            self._enqueue(waiter)
+            while not waiter.granted:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline.remaining()
+                    if timeout <= 0:
+                        lane.waiting.remove(waiter)
+                        raise DeadlineExceeded(
+                            'Deadline exceeded waiting for a slot in the %s lane' % lane.name,
+                            deadline)
+                self._condition.wait(timeout)
+        self._local.lane = lane
+        try:
+            yield
+        finally:
+            self._local.lane = None
+            self._release(lane)
+
+    def metrics(self):
+        """Returns the number of active, waiting and started calls of each lane."""
+        with self._condition:
+            return dict((lane.name, dict(
+                active = lane.active,
+                waiting = len(lane.waiting),
+                started = lane.started,
+            )) for lane in self.lanes)
+
+    def shutdown(self, wait=True):
+        with self._condition:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
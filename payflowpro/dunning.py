@@ -0,0 +1,340 @@
+"""
+Retrying of failed recurring billing payments ("dunning").
+
+A `DunningScheduler` finds failed payments by running
+`profile_inquiry(payment_history_only=True)` across the merchant's
+recurring profiles, and keeps them in a SQLite index together with the
+time each is next due to be retried. `retry_due` then calls `profile_pay`
+for the payments that are due, in batches and at a limited rate, until
+each is either paid or has used up its `retry_schedule`:
+
+    scheduler = DunningScheduler('/var/lib/payflowpro/dunning.db', client)
+
+    # Nightly, with the profile IDs streamed from the merchant's database
+    scheduler.scan(profile_id for (profile_id,) in cursor)
+
+    # Every few minutes
+    scheduler.retry_due()
+
+Scans and retries run in the dispatcher's background lane, so they don't
+hold up interactive calls made with the same client. Profile IDs are read
+from the iterable given to `scan` only as slots to inquire about them come
+free, and retries are read from the index a batch at a time, so neither
+needs more memory for millions of profiles than for a few.
+
+Each retry is sent with a request ID that is stored in the index before
+the call is made. A retry interrupted by a crash is sent again with the
+same ID once its lease expires, so the gateway does not charge twice.
+A retry that keeps raising errors is given up on after `max_errors` tries.
+"""
+import sqlite3
+import time
+import uuid
+
+from collections import deque
+
+from .classes import RecurringPayments
+from .classes import Response
+from .dispatch import BACKGROUND
+
+PENDING = 'pending' # Waiting for its next retry
+RETRYING = 'retrying' # A retry is in flight
+RECOVERED = 'recovered' # Paid, by a retry or otherwise
+EXHAUSTED = 'exhausted' # Every retry failed
+
+APPROVED = '0'
+
+DAY = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS failed_payments (
+    profile_id TEXT NOT NULL,
+    payment_number INTEGER NOT NULL,
+    pnref TEXT,
+    amount TEXT,
+    transtime TEXT,
+    result TEXT,
+    status TEXT NOT NULL,
+    retries INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    next_retry_at REAL NOT NULL,
+    request_id TEXT,
+    last_result TEXT,
+    last_error TEXT,
+    found_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (profile_id, payment_number)
+);
+CREATE INDEX IF NOT EXISTS failed_payments_due ON failed_payments (status, next_retry_at);
+"""
+
+
+class DunningScheduler(object):
+    """
+    Schedules retries of the failed payments of recurring profiles, using
+    an index stored in the SQLite database at `path`.
+
+    A failed payment is retried `retry_schedule[n]` seconds after it was
+    found or after its previous retry failed, for as many retries as there
+    are delays. `scan_concurrency` inquiries are kept in flight while
+    scanning. Retries are sent `batch_size` at a time, at no more than
+    `rate` per second on average; a retry that has not finished within
+    `lease_timeout` seconds, because the process running it died, is sent
+    again by the next `retry_due`. A retry that raises an error is sent
+    again with the same request ID, up to `max_errors` times in a row,
+    before the payment is given up on.
+    """
+
+    RETRY_SCHEDULE = (1 * DAY, 3 * DAY, 7 * DAY)
+    SCAN_CONCURRENCY = 32 # Profile inquiries in flight at once
+    BATCH_SIZE = 50 # Retries sent, and scan results written, at a time
+    RATE = 5.0 # Retries per second
+    LEASE_TIMEOUT = 300 # Seconds before an unfinished retry is sent again
+    MAX_ERRORS = 5 # Errors in a row before a payment is given up on
+
+    def __init__(self, path, client, retry_schedule=RETRY_SCHEDULE,
+        scan_concurrency=SCAN_CONCURRENCY, batch_size=BATCH_SIZE, rate=RATE,
+        lease_timeout=LEASE_TIMEOUT, max_errors=MAX_ERRORS, priority=BACKGROUND):
+
+        self.path = path
+        self.client = client
+        self.retry_schedule = retry_schedule
+        self.scan_concurrency = scan_concurrency
+        self.batch_size = batch_size
+        self.rate = rate
+        self.lease_timeout = lease_timeout
+        self.max_errors = max_errors
+        self.priority = priority
+        self._connection = None
+
+    def _get_connection(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+    connection = property(_get_connection)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    ##### Scanning #####
+
+    def scan(self, profile_ids, now=None):
+        """
+        Inquires about the payment history of each profile in the iterable
+        `profile_ids`, adds the failed payments that are not yet indexed,
+        and marks indexed payments that have since been paid as recovered.
+        Returns a dictionary of counts of the profiles scanned, the failed
+        payments found and the inquiries that raised an error.
+        """
+        stats = dict(profiles=0, failed=0, errors=0)
+        in_flight = deque()
+        histories = []
+        for profile_id in profile_ids:
+            if len(in_flight) >= self.scan_concurrency:
+                self._collect(in_flight.popleft(), histories, stats)
+                if len(histories) >= self.batch_size:
+                    stats['failed'] += self._index(histories, now)
+                    histories = []
+            # Inquiries made at the same moment would otherwise share a
+            # request ID, and get each other's responses from the gateway
+            in_flight.append((profile_id, self.client.submit('profile_inquiry',
+                profile_id, payment_history_only=True, request_id=uuid.uuid4().hex,
+                priority=self.priority)))
+        while in_flight:
+            self._collect(in_flight.popleft(), histories, stats)
+        stats['failed'] += self._index(histories, now)
+        return stats
+
+    def _collect(self, call, histories, stats):
+        profile_id, future = call
+        stats['profiles'] += 1
+        try:
+            result_objects, unconsumed_data = future.result()
+        except Exception as e:
+            stats['errors'] += 1
+            self.client.log.warning(
+                u'Payment history inquiry for %s raised an error - %s' % (profile_id, e))
+            return
+        payments = result_objects.get(RecurringPayments)
+        if payments is not None:
+            histories.append((profile_id, payments))
+
+    def _index(self, histories, now=None):
+        """
+        Records the payment histories of a batch of profiles in a single
+        transaction, and returns the number of failed payments added.
+        """
+        if now is None:
+            now = time.time()
+        failed = []
+        paid = []
+        for profile_id, payments in histories:
+            for number, payment in payments.numbered():
+                if payment.p_result == APPROVED:
+                    paid.append((RECOVERED, now, profile_id, number))
+                else:
+                    failed.append((profile_id, number, payment.p_pnref, payment.p_amt,
+                        payment.p_transtime, payment.p_result, PENDING,
+                        now + self.retry_schedule[0], now, now))
+        if not (failed or paid):
+            return 0
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            before = connection.total_changes
+            connection.executemany(
+                'INSERT OR IGNORE INTO failed_payments (profile_id, payment_number, '
+                'pnref, amount, transtime, result, status, next_retry_at, found_at, '
+                'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', failed)
+            added = connection.total_changes - before
+            connection.executemany(
+                'UPDATE failed_payments SET status = ?, updated_at = ? '
+                'WHERE profile_id = ? AND payment_number = ? AND status IN (?, ?)',
+                [row + (PENDING, EXHAUSTED) for row in paid])
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        return added
+
+    ##### Retrying #####
+
+    def claim(self, limit, now=None):
+        """
+        Marks up to `limit` payments that are due as being retried, and
+        returns their `(profile_id, payment_number, request_id, retries,
+        errors)` tuples. Payments whose previous retry outlived its lease keep its
+        request ID, so that the gateway recognises a retry it already
+        processed.
+        """
+        if now is None:
+            now = time.time()
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                'SELECT profile_id, payment_number, status, request_id, retries, errors '
+                'FROM failed_payments WHERE status IN (?, ?) AND next_retry_at <= ? '
+                'ORDER BY next_retry_at LIMIT ?',
+                (PENDING, RETRYING, now, limit)).fetchall()
+            claimed = []
+            for profile_id, number, status, request_id, retries, errors in rows:
+                if status == PENDING or request_id is None:
+                    request_id = uuid.uuid4().hex
+                claimed.append((profile_id, number, request_id, retries, errors))
+            connection.executemany(
+                'UPDATE failed_payments SET status = ?, request_id = ?, '
+                'next_retry_at = ?, updated_at = ? '
+                'WHERE profile_id = ? AND payment_number = ?',
+                [(RETRYING, request_id, now + self.lease_timeout, now, profile_id, number)
+                 for profile_id, number, request_id, retries, errors in claimed])
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def _outcome(self, retries, errors, outcome, now):
+        """
+        Returns the new status of a payment after a retry, the number of
+        retries it has used, the number of errors in a row its retries have
+        raised, when it is next due and its result or error.
+        """
+        if isinstance(outcome, Exception):
+            errors += 1
+            if errors >= self.max_errors:
+                # A later scan marks the payment recovered if one of the
+                # retries did reach the gateway
+                return (EXHAUSTED, retries, errors, now, None, str(outcome))
+            # The retry may or may not have reached the gateway, so it is
+            # sent again with the same request ID once the lease expires
+            return (RETRYING, retries, errors, now + self.lease_timeout, None, str(outcome))
+        response = outcome[0].get(Response)
+        result = response.result if response is not None else None
+        retries += 1
+        if result == APPROVED:
+            return (RECOVERED, retries, 0, now, result, None)
+        if retries >= len(self.retry_schedule):
+            return (EXHAUSTED, retries, 0, now, result, None)
+        return (PENDING, retries, 0, now + self.retry_schedule[retries], result, None)
+
+    def retry_due(self, limit=None, now=None):
+        """
+        Calls `profile_pay` for the payments that are due for a retry, up to
+        `limit` of them, and records the outcomes. Returns a dictionary of
+        counts of the retries made, the payments recovered and exhausted,
+        and the retries that raised an error.
+        """
+        stats = dict(retried=0, recovered=0, exhausted=0, errors=0)
+        while limit is None or stats['retried'] < limit:
+            size = self.batch_size
+            if limit is not None:
+                size = min(size, limit - stats['retried'])
+            started = time.monotonic()
+            claimed = self.claim(size, now)
+            if not claimed:
+                break
+            outcomes = self.client.batch([
+                ('profile_pay', (profile_id, number), dict(request_id=request_id))
+                for profile_id, number, request_id, retries, errors in claimed],
+                return_exceptions=True, priority=self.priority)
+
+            finished = time.time() if now is None else now
+            updates = []
+            for (profile_id, number, request_id, retries, errors), outcome in \
+                    zip(claimed, outcomes):
+                status, retries, errors, next_retry_at, result, error = \
+                    self._outcome(retries, errors, outcome, finished)
+                if error is not None:
+                    stats['errors'] += 1
+                    self.client.log.warning(u'Retry of payment %s of %s raised an error - %s'
+                        % (number, profile_id, error))
+                if status == RECOVERED:
+                    stats['recovered'] += 1
+                elif status == EXHAUSTED:
+                    stats['exhausted'] += 1
+                if status != RETRYING:
+                    request_id = None # The next retry is a new transaction
+                updates.append((status, retries, errors, next_retry_at, request_id, result,
+                                error, finished, profile_id, number))
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany(
+                    'UPDATE failed_payments SET status = ?, retries = ?, errors = ?, '
+                    'next_retry_at = ?, request_id = ?, last_result = COALESCE(?, last_result), '
+                    'last_error = ?, updated_at = ? WHERE profile_id = ? AND payment_number = ?',
+                    updates)
+                connection.execute('COMMIT')
+            except:
+                connection.execute('ROLLBACK')
+                raise
+            stats['retried'] += len(claimed)
+
+            # Sends batches no faster than `rate` retries per second
+            wait = started + len(claimed) / float(self.rate) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        return stats
+
+    ##### Reporting #####
+
+    def counts(self):
+        """Returns a dictionary of the number of indexed payments in each status."""
+        return dict(self.connection.execute(
+            'SELECT status, COUNT(*) FROM failed_payments GROUP BY status').fetchall())
+
+    def payments(self, profile_id):
+        """Returns a list of dictionaries describing a profile's indexed payments."""
+        cursor = self.connection.execute(
+            'SELECT * FROM failed_payments WHERE profile_id = ? ORDER BY payment_number',
+            (profile_id,))
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
@@ -0,0 +1,115 @@
+"""
+Routing of gateway requests across several endpoints, such as regional
+gateways or egress proxies.
+
+An `EndpointPool` keeps an exponentially weighted moving average of each
+endpoint's latency and sends each attempt to the healthy endpoint with the
+lowest. An endpoint that can't be connected to is taken out of rotation
+for `cooldown` seconds, and the attempt is retried on another endpoint
+with the same request ID, so the gateway still recognises it as the same
+transaction:
+
+    client = PayflowProClient(..., endpoints=[
+        'https://payflowpro.paypal.com',
+        'https://egress-1.example.com',
+    ], redirect=PayflowProClient.REDIRECT_LIVE) # Required with endpoints
+
+    client.endpoints.status()
+"""
+import threading
+import time
+
+
+class Endpoint(object):
+    def __init__(self, url):
+        from urllib.parse import urlsplit
+        self.url = url
+        self.host = urlsplit(url)[1]
+        self.latency = None # EWMA of successful attempts, in seconds
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0
+        self.last_used = None
+
+    def healthy(self, now=None):
+        return (now or time.monotonic()) >= self.down_until
+
+    def __str__(self):
+        return 'Endpoint %s' % self.url
+
+
+class EndpointPool(object):
+    """
+    Chooses between the endpoints at `urls`. `alpha` is the weight of each
+    new latency in the moving averages. An endpoint that has not been used
+    for `probe_interval` seconds is tried again, so that the averages of
+    slower endpoints don't go stale.
+    """
+
+    def __init__(self, urls, alpha=0.2, cooldown=30, probe_interval=60):
+        if not urls:
+            raise ValueError('At least one endpoint is required')
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+
+    def choose(self, exclude=()):
+        """
+        Returns the endpoint for the next attempt, avoiding those in
+        `exclude` as long as there are others. If every endpoint is down,
+        the one that has been down longest is tried.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint not in exclude] or self.endpoints
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy(now)]
+            if not healthy:
+                endpoint = min(candidates, key=lambda endpoint: endpoint.down_until)
+            else:
+                def score(endpoint):
+                    if endpoint.latency is None or now - endpoint.last_used > self.probe_interval:
+                        return -1 # Unmeasured or stale: measure it
+                    return endpoint.latency
+                # min() keeps the first of equals, so ties go by the order given
+                endpoint = min(healthy, key=score)
+            endpoint.last_used = now
+            endpoint.requests += 1
+            return endpoint
+
+    def record_success(self, endpoint, latency):
+        with self._lock:
+            endpoint.consecutive_failures = 0
+            endpoint.down_until = 0
+            if latency is not None:
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency += self.alpha * (latency - endpoint.latency)
+
+    def record_failure(self, endpoint, connected):
+        """
+        Records a failed attempt. Endpoints that could not be `connected`
+        to are taken out of rotation for the cooldown period; those that
+        may have been, for which `connected` is None, are not.
+        """
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if connected is False:
+                endpoint.down_until = time.monotonic() + self.cooldown
+
+    def status(self):
+        """Returns a dictionary describing the state of each endpoint."""
+        now = time.monotonic()
+        with self._lock:
+            return [dict(
+                url = endpoint.url,
+                healthy = endpoint.healthy(now),
+                latency = endpoint.latency,
+                requests = endpoint.requests,
+                failures = endpoint.failures,
+            ) for endpoint in self.endpoints]
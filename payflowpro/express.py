@@ -0,0 +1,275 @@
+"""
+A session layer for PayPal Express Checkout, built on the client's
+`set_checkout`, `get_checkout` and `do_checkout` methods.
+
+`ExpressCheckoutSession` keeps the state of every token it has seen, so
+that pages which are reloaded or hit concurrently make the minimum number
+of gateway round trips: payer details are fetched once per token and
+reused, and completing a checkout twice returns the original result rather
+than charging the buyer again.
+
+Example usage:
+
+    session = ExpressCheckoutSession(client)
+
+    # On the cart page
+    checkout = session.set_checkout(SetPaypal(returnurl=..., cancelurl=...), amount)
+    redirect(checkout.redirect_url)
+
+    # On the confirmation page, as often as it is reloaded
+    details = session.get_checkout(token)
+
+    # When the buyer confirms
+    responses, unconsumed_data = session.do_checkout(token, amount)
+
+Each method has an `_async` variant that can be awaited from an `asyncio`
+coroutine.
+"""
+import threading
+import time
+import uuid
+
+from concurrent.futures import Future
+
+from .classes import DoPaypal
+from .classes import ExpressResponse
+from .classes import GetPaypal
+from .classes import Response
+from .client import find_class_in_list
+from .deadline import as_deadline
+from .dispatch import INTERACTIVE
+
+SET = 'set'
+DETAILS = 'details'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class ExpressCheckoutError(Exception):
+    def __init__(self, message, checkout=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.checkout = checkout
+
+
+def _express_response(result_objects):
+    """
+    Gathers the Express Checkout fields of a result into an
+    `ExpressResponse`. `parse_parameters` hands fields such as `token` and
+    `payerid` to whichever class claims them first, which is not
+    necessarily `ExpressResponse`.
+    """
+    data = {}
+    for obj in result_objects:
+        fields = getattr(obj, 'fields', {})
+        for name in ExpressResponse.base_fields:
+            if name in fields and fields[name].value is not None:
+                data.setdefault(name, fields[name].value)
+    if 'token' not in data:
+        return None
+    return ExpressResponse(**data)
+
+
+def _is_approved(result_objects):
+    response = find_class_in_list(Response, result_objects)
+    return response is not None and response.result == '0'
+
+
+class ExpressCheckout(object):
+    """
+    The state of a single Express Checkout token. A checkout moves from
+    `set` (token issued) to `details` (payer details fetched) to
+    `completed`, or to `failed` if the gateway declines `do_checkout`.
+    """
+
+    def __init__(self, token, redirect_url=None, state=SET):
+        self.token = token
+        self.redirect_url = redirect_url
+        self.state = state
+        self.details = None
+        self.details_result = None
+        self.result = None
+        self.do_request_id = uuid.uuid4().hex
+        self.created = time.time()
+        self._lock = threading.Lock()
+        self._pending_details = None
+
+    def _get_payerid(self):
+        if self.details is None:
+            return None
+        return self.details.payerid
+    payerid = property(_get_payerid)
+
+    def __str__(self):
+        return 'ExpressCheckout %s: %s' % (self.token, self.state)
+
+
+class ExpressCheckoutSession(object):
+    """
+    Tracks Express Checkout tokens for a `PayflowProClient`.
+
+    Tokens are kept in `store`, a dictionary by default. Express Checkout
+    tokens expire after three hours, so entries older than `token_ttl`
+    seconds are discarded. The buyer is waiting on every call, so they are
+    made with `priority` INTERACTIVE unless told otherwise.
+    """
+
+    TOKEN_TTL = 3 * 60 * 60
+
+    def __init__(self, client, store=None, token_ttl=TOKEN_TTL, priority=INTERACTIVE):
+        self.client = client
+        self.store = {} if store is None else store
+        self.token_ttl = token_ttl
+        self.priority = priority
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        cutoff = time.time() - self.token_ttl
+        for token, checkout in list(self.store.items()):
+            if checkout.created < cutoff:
+                self.store.pop(token, None)
+
+    def checkout(self, token):
+        """
+        Returns the `ExpressCheckout` for `token`. Tokens this session has
+        not seen, such as one arriving on a return URL handled by another
+        process, are assumed to have been issued by `set_checkout`.
+        """
+        with self._lock:
+            checkout = self.store.get(token)
+            if checkout is None or checkout.created < time.time() - self.token_ttl:
+                self._expire()
+                checkout = ExpressCheckout(token, self.client.redirect + token)
+                self.store[token] = checkout
+            return checkout
+
+    def set_checkout(self, setpaypal, amount, extras=[], request_id=None,
+        deadline=None):
+        """
+        Starts a checkout and returns its `ExpressCheckout`, whose
+        `redirect_url` the buyer should be sent to. Raises
+        `ExpressCheckoutError` if the gateway does not issue a token.
+        """
+        result_objects, unconsumed_data = self.client.set_checkout(
+            setpaypal, amount, extras=extras, request_id=request_id,
+            deadline=deadline, priority=self.priority)
+        express = _express_response(result_objects)
+        if not _is_approved(result_objects) or express is None:
+            response = find_class_in_list(Response, result_objects)
+            raise ExpressCheckoutError(
+                'set_checkout failed: %s' % (response and response.respmsg))
+        checkout = ExpressCheckout(express.token, self.client.redirect + express.token)
+        with self._lock:
+            self.store[checkout.token] = checkout
+        return checkout
+
+    def get_checkout(self, token, extras=[], refresh=False, deadline=None):
+        """
+        Returns the `ExpressResponse` holding the payer details for
+        `token`, calling `get_checkout` on the gateway only the first time
+        (or when `refresh` is true). Concurrent callers for the same token
+        share a single gateway call. The full result list is available as
+        the checkout's `details_result`.
+        """
+        checkout = self.checkout(token)
+        with checkout._lock:
+            if checkout.details is not None and not refresh:
+                return checkout.details
+            pending = checkout._pending_details
+            owner = pending is None
+            if owner:
+                pending = checkout._pending_details = Future()
+        if not owner:
+            return pending.result()
+
+        try:
+            result_objects, unconsumed_data = self.client.get_checkout(
+                GetPaypal(token=token), extras=extras, deadline=deadline,
+                priority=self.priority)
+            details = _express_response(result_objects)
+            if not _is_approved(result_objects) or details is None:
+                response = find_class_in_list(Response, result_objects)
+                raise ExpressCheckoutError(
+                    'get_checkout failed: %s' % (response and response.respmsg),
+                    checkout)
+        except Exception as e:
+            with checkout._lock:
+                checkout._pending_details = None
+            pending.set_exception(e)
+            raise
+        with checkout._lock:
+            checkout.details = details
+            checkout.details_result = result_objects
+            if checkout.state == SET:
+                checkout.state = DETAILS
+            checkout._pending_details = None
+        pending.set_result(details)
+        return details
+
+    def do_checkout(self, token, amount, payerid=None, extras=[], deadline=None):
+        """
+        Completes the checkout for `token` and returns the
+        `(result_objects, unconsumed_data)` tuple of `do_checkout`. The
+        payer ID is taken from the cached payer details when not given,
+        fetching them if necessary. Once a checkout has completed, its
+        original result is returned instead of calling the gateway again.
+
+        Every attempt to complete a checkout reuses the same request ID
+        until the gateway declines it, so retrying after a network error
+        cannot charge the buyer twice.
+        """
+        checkout = self.checkout(token)
+        if payerid is None:
+            with checkout._lock:
+                if checkout.state == COMPLETED:
+                    return checkout.result
+            payerid = self.get_checkout(token, deadline=deadline).payerid
+        with checkout._lock:
+            if checkout.state == COMPLETED:
+                return checkout.result
+            result = self.client.do_checkout(
+                DoPaypal(token=token, payerid=payerid), amount, extras=extras,
+                request_id=checkout.do_request_id, deadline=deadline,
+                priority=self.priority)
+            checkout.result = result
+            if _is_approved(result[0]):
+                checkout.state = COMPLETED
+            else:
+                checkout.state = FAILED
+                checkout.do_request_id = uuid.uuid4().hex
+        return result
+
+    def forget(self, token):
+        """Discards the state kept for `token`."""
+        with self._lock:
+            self.store.pop(token, None)
+
+    ##### Asynchronous variants #####
+
+    def set_checkout_async(self, setpaypal, amount, extras=[], request_id=None,
+        deadline=None):
+        return self._call_async(self.set_checkout, setpaypal, amount,
+            extras=extras, request_id=request_id, deadline=as_deadline(deadline))
+
+    def get_checkout_async(self, token, extras=[], refresh=False, deadline=None):
+        checkout = self.store.get(token)
+        if checkout is not None and checkout.details is not None and not refresh:
+            # Answer from the cache without leaving the event loop
+            future = Future()
+            future.set_result(checkout.details)
+            return self._wrap_future(future)
+        return self._call_async(self.get_checkout, token, extras=extras,
+            refresh=refresh, deadline=as_deadline(deadline))
+
+    def do_checkout_async(self, token, amount, payerid=None, extras=[],
+        deadline=None):
+        return self._call_async(self.do_checkout, token, amount,
+            payerid=payerid, extras=extras, deadline=as_deadline(deadline))
+
+    def _call_async(self, fn, *args, **kwargs):
+        return self._wrap_future(self.client.dispatcher.schedule(
+            self.priority, fn, *args, **kwargs))
+
+    def _wrap_future(self, future):
+        import asyncio
+        return asyncio.wrap_future(future)
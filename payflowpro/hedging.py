@@ -0,0 +1,160 @@
+"""
+Hedged requests: if a gateway call has not answered within a latency
+percentile, a second copy of it is sent and whichever answers first is
+used.
+
+This is safe because both copies carry the same X-VPS-REQUEST-ID, which
+Payflow Pro uses to recognise the second as a duplicate of the first
+rather than as a new transaction. Once one copy has answered, the other
+is cancelled by shutting down its connection.
+
+Example usage:
+
+    # Hedge after the 95th percentile of recent latencies
+    client = PayflowProClient(..., hedging=HedgingPolicy())
+
+    # Hedge after a fixed 1.5 seconds
+    client = PayflowProClient(..., hedging=HedgingPolicy(delay=1.5))
+
+    client.hedging.metrics()
+"""
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import wait
+
+from .transport import Cancellation
+
+
+def _run_in_thread(fn, *args, **kwargs):
+    future = Future()
+
+    def target():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    thread = threading.Thread(target=target, name='payflowpro-hedge')
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+class HedgingPolicy(object):
+    """
+    Decides when to hedge a request and keeps count of how often it did.
+
+    With a fixed `delay`, requests are hedged after that many seconds.
+    Otherwise the delay is the `percentile` of the latencies of the last
+    `window` attempts, and nothing is hedged until `min_samples` latencies
+    have been observed. `min_delay` stops a run of fast responses from
+    turning every request into two.
+    """
+
+    def __init__(self, delay=None, percentile=0.95, window=1000, min_samples=20,
+        min_delay=0.05):
+
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = deque(maxlen=window)
+        self._sorted = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def observe(self, latency):
+        """Records the latency of a completed attempt."""
+        with self._lock:
+            self._latencies.append(latency)
+            self._sorted = None
+
+    def hedge_delay(self):
+        """Returns how long to wait before hedging, or None not to hedge."""
+        if self.delay is not None:
+            return self.delay
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            if self._sorted is None:
+                self._sorted = sorted(self._latencies)
+            latencies = self._sorted
+        index = min(int(len(latencies) * self.percentile), len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
+
+    def _timed(self, send, args):
+        started = time.monotonic()
+        cancellation = Cancellation()
+        future = _run_in_thread(send, *args, cancellation=cancellation)
+        future.cancellation = cancellation
+
+        def done(future):
+            if future.exception() is None:
+                self.observe(time.monotonic() - started)
+        future.add_done_callback(done)
+        return future
+
+    def run(self, send, *args):
+        """
+        Calls `send(*args)`, calling it a second time if the first call
+        takes longer than the hedge delay, and returns the first successful
+        result. An exception is only raised if both calls fail. `send`
+        should work out its timeout when it is called, so that a second
+        call gets only the time that is left.
+
+        When the calls are made in threads, `send` is also given a
+        `cancellation` keyword argument, a `Cancellation` that is cancelled
+        if the other call answers first.
+        """
+        delay = self.hedge_delay()
+        with self._lock:
+            self.requests += 1
+        if delay is None:
+            # Nothing will be hedged, so there is no need for a thread
+            started = time.monotonic()
+            result = send(*args)
+            self.observe(time.monotonic() - started)
+            return result
+        primary = self._timed(send, args)
+        done, pending = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        with self._lock:
+            self.hedged += 1
+        hedge = self._timed(send, args)
+        pending = set([primary, hedge])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    for other in pending:
+                        other.cancellation.cancel()
+                    return future.result()
+        return primary.result()
+
+    def metrics(self):
+        """
+        Returns the number of requests, how many were hedged and how many
+        of those were won by the hedge, with the hedge and win rates.
+        """
+        with self._lock:
+            requests, hedged, wins = self.requests, self.hedged, self.hedge_wins
+        return dict(
+            requests = requests,
+            hedged = hedged,
+            hedge_wins = wins,
+            hedge_rate = float(hedged) / requests if requests else 0.0,
+            win_rate = float(wins) / hedged if hedged else 0.0,
+            hedge_delay = self.hedge_delay(),
+        )
@@ -0,0 +1,130 @@
+"""
+Measures how long importing the client takes, so that regressions in the
+start-up time of short-lived processes such as workers and command line
+tools are noticed.
+
+Importing `payflowpro.client` loads only what is needed to construct a
+client. The networking, logging, regular expression and thread pool
+modules are imported when they are first used, and the methods of the
+`PayflowProObject` classes are generated when they are first called.
+Running the module reports the slowest imports in a fresh interpreter and
+fails if the total exceeds `BUDGET`, or if one of `DEFERRED_MODULES` was
+imported:
+
+    $ python -m payflowpro.importtime --top 10
+
+The first run writes the bytecode caches, and the fastest of the remaining
+runs is reported, so that compiling the source is not counted. Timings
+depend on the machine, so the test suite checks only `DEFERRED_MODULES`;
+the budget, which leaves a wide margin over a typical import, is enforced
+by running this module.
+"""
+import os
+import subprocess
+import sys
+
+MODULE = 'payflowpro.client'
+
+BUDGET = 0.060 # Seconds, for MODULE and everything it imports
+
+# Modules that importing MODULE must not import
+DEFERRED_MODULES = ('ssl', 'socket', 'http.client', 'urllib.parse', 'urllib.request',
+                    'email', 'logging', 're', 'concurrent.futures', 'decimal')
+
+
+def _python(code, *options):
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        [path for path in [env.get('PYTHONPATH')] if path])
+    return subprocess.run([sys.executable] + list(options) + ['-c', code], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+def _parse(output):
+    # Lines look like "import time:   self [us] |   cumulative | name",
+    # with the name indented by its depth in the import tree
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue # The header
+        times[name.strip()] = (int(own) / 1e6, int(cumulative) / 1e6)
+    return times
+
+
+def measure(module=MODULE, runs=5):
+    """
+    Imports `module` in `runs` fresh interpreters, and returns a dictionary
+    mapping the name of each module imported to its own and cumulative
+    import times in seconds, from the fastest run.
+    """
+    code = 'import %s' % module
+    _python(code) # Writes the bytecode caches
+    best = None
+    for i in range(runs):
+        times = _parse(_python(code, '-X', 'importtime').stderr)
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+    return best
+
+
+def loaded_modules(module=MODULE):
+    """Returns the names of the modules loaded by importing `module`."""
+    code = 'import sys\nbefore = set(sys.modules)\nimport %s\n' \
+        'print("\\n".join(sorted(set(sys.modules) - before)))' % module
+    return _python(code).stdout.split()
+
+
+def _problems(module, total, budget):
+    loaded = loaded_modules(module)
+    problems = ['%s imports %s' % (module, name) for name in DEFERRED_MODULES
+                if name in loaded]
+    if total > budget:
+        problems.append('%s takes %.1fms to import, over the budget of %.1fms' % (
+            module, total * 1000, budget * 1000))
+    return problems
+
+
+def check(module=MODULE, budget=BUDGET, runs=5):
+    """
+    Returns a list of problems with importing `module`: the modules in
+    `DEFERRED_MODULES` it imports, and whether it takes longer than
+    `budget` seconds.
+    """
+    return _problems(module, measure(module, runs)[module][1], budget)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m payflowpro.importtime',
+        description='Report how long importing the client takes.')
+    parser.add_argument('--module', default=MODULE, help='module to import')
+    parser.add_argument('--top', type=int, default=15,
+        help='number of the slowest imports to show')
+    parser.add_argument('--runs', type=int, default=5, help='number of imports to time')
+    parser.add_argument('--budget', type=float, default=BUDGET * 1000,
+        help='maximum import time in milliseconds')
+    args = parser.parse_args(argv)
+
+    times = measure(args.module, args.runs)
+    print('%10s %10s  %s' % ('self (ms)', 'total (ms)', 'module'))
+    slowest = sorted(times.items(), key=lambda item: -item[1][1])[:args.top]
+    for name, (own, cumulative) in slowest:
+        print('%10.2f %10.2f  %s' % (own * 1000, cumulative * 1000, name))
+
+    total = times[args.module][1]
+    problems = _problems(args.module, total, args.budget / 1000)
+    print('\n%s: %.1fms' % (args.module, total * 1000))
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
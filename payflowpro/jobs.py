@@ -0,0 +1,440 @@
+"""
+A durable, SQLite-backed job queue for running Payflow Pro transactions
+outside of web request threads.
+
+Producers enqueue a transaction descriptor -- the name of a
+`PayflowProClient` method, its `PayflowProObject` arguments and a request
+ID -- and a pool of worker processes drains the queue, calling the gateway
+and writing the results back.
+
+Delivery is at-least-once: a job reserved by a worker becomes visible to
+other workers again once its visibility timeout expires without an
+acknowledgement, for instance because the worker process died. This is
+made safe by fixing the request ID when the job is enqueued and reusing it
+on every delivery, so Payflow Pro treats a redelivered job as a duplicate
+of the original transaction and returns the original response.
+
+Card data is never written to the queue database as it is. Security codes
+are not stored at all, so queued card transactions are sent without CVV2.
+Card numbers and track data are replaced with tokens by the queue's
+`tokenizer`, an object supplied by the caller -- typically a client for a
+card vault -- with `tokenize(value)` and `detokenize(token)` methods; card
+data can't be enqueued without one. The arguments of a job are deleted
+from the database once it has finished or failed.
+
+Example usage:
+
+    # In the web process
+    queue = JobQueue('/var/spool/payflowpro/jobs.db', tokenizer=vault)
+    job_id = queue.enqueue('sale', credit_card, Amount(amt=15, currency='USD'))
+
+    # In a separate daemon
+    client_factory = functools.partial(PayflowProClient, partner, vendor,
+                                       username, password)
+    pool = WorkerPool('/var/spool/payflowpro/jobs.db', client_factory, processes=8,
+                      queue_options=dict(tokenizer=vault))
+    pool.start()
+
+    # Back in the web process
+    responses, unconsumed_data = queue.wait(job_id)
+"""
+import json
+import multiprocessing
+import sqlite3
+import time
+import uuid
+from decimal import Decimal
+
+from . import classes
+from . import serialization
+from .classes import PayflowProObjectBase
+from .classes import RecurringPayments
+from .classes import ResultSet
+
+PENDING = 'pending'
+RESERVED = 'reserved'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    method TEXT NOT NULL,
+    arguments TEXT,
+    request_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    visible_at REAL NOT NULL,
+    lease TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, visible_at);
+"""
+
+# Parameters that are replaced with tokens before a job is stored, and that
+# are never stored at all
+TOKENIZED_PARAMETERS = ('acct', 'swipe', 'micr')
+DISCARDED_PARAMETERS = ('cvv2',)
+
+
+class JobFailed(Exception):
+    def __init__(self, job_id, message):
+        Exception.__init__(self, 'Job %s failed: %s' % (job_id, message))
+        self.job_id = job_id
+        self.message = message
+
+
+def encode_value(value, tokenizer=None):
+    """
+    Converts transaction arguments into a JSON-compatible structure.
+    `PayflowProObject` instances are stored as their class name and `data`
+    dictionary, without the `DISCARDED_PARAMETERS` and with the values of
+    the `TOKENIZED_PARAMETERS` replaced by tokens from `tokenizer`.
+    """
+    if isinstance(value, PayflowProObjectBase):
+        data = dict([(key, item) for key, item in value.data.items()
+                     if key not in DISCARDED_PARAMETERS])
+        for key in TOKENIZED_PARAMETERS:
+            if data.get(key) is not None:
+                if tokenizer is None:
+                    raise ValueError("Card data can only be queued with a tokenizer")
+                data[key] = {'__token__': tokenizer.tokenize(str(data[key]))}
+        return {'__class__': value.__class__.__name__,
+                'data': encode_value(data, tokenizer)}
+    if isinstance(value, RecurringPayments):
+        return {'__payments__': [encode_value(p, tokenizer) for p in value]}
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item, tokenizer) for item in value]
+    if isinstance(value, dict):
+        return dict([(key, encode_value(item, tokenizer)) for key, item in value.items()])
+    return value
+
+
+def decode_value(value, tokenizer=None):
+    """Reverses `encode_value`."""
+    if isinstance(value, list):
+        return [decode_value(item, tokenizer) for item in value]
+    if isinstance(value, dict):
+        if '__class__' in value:
+            klass = getattr(classes, value['__class__'], None)
+            if not (isinstance(klass, type) and issubclass(klass, PayflowProObjectBase)):
+                raise ValueError("Unknown PayflowProObject class '%s'" % value['__class__'])
+            return klass(data=decode_value(value['data'], tokenizer))
+        if '__payments__' in value:
+            return RecurringPayments(payments=decode_value(value['__payments__'], tokenizer))
+        if '__decimal__' in value:
+            return Decimal(value['__decimal__'])
+        if '__token__' in value:
+            if tokenizer is None:
+                raise ValueError("Card data can only be read with a tokenizer")
+            return tokenizer.detokenize(value['__token__'])
+        return dict([(key, decode_value(item, tokenizer)) for key, item in value.items()])
+    return value
+
+
+class JobQueue(object):
+    """
+    A job queue stored in a SQLite database, which may be shared by any
+    number of producer and worker processes on the same host. Card data
+    is stored as tokens from `tokenizer`; see the module documentation.
+    """
+
+    VISIBILITY_TIMEOUT = 300 # Seconds a reserved job stays hidden from other workers
+    MAX_ATTEMPTS = 5 # Deliveries before a job is marked as failed
+    RETRY_DELAY = 5 # Seconds before a job that raised an error is retried
+
+    def __init__(self, path, visibility_timeout=VISIBILITY_TIMEOUT,
+        max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY, tokenizer=None):
+
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.tokenizer = tokenizer
+        self._connection = None
+
+    def _get_connection(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+    connection = property(_get_connection)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def enqueue(self, method, *args, **kwargs):
+        """
+        Adds a call to the named `PayflowProClient` method to the queue and
+        returns the new job's ID. Positional and keyword arguments are
+        passed to the method when the job runs. A `request_id` keyword
+        argument is used as the transaction's X-VPS-REQUEST-ID; if none is
+        given, a unique one is generated now so that every delivery of the
+        job reuses it. Raises ValueError if the arguments hold card data and
+        the queue has no tokenizer.
+        """
+        request_id = kwargs.pop('request_id', None)
+        if request_id is None:
+            request_id = uuid.uuid4().hex
+        arguments = json.dumps(dict(
+            args = encode_value(list(args), self.tokenizer),
+            kwargs = encode_value(kwargs, self.tokenizer),
+        ))
+        now = time.time()
+        cursor = self.connection.execute(
+            'INSERT INTO jobs (method, arguments, request_id, status, '
+            'visible_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (method, arguments, str(request_id), PENDING, now, now, now))
+        return cursor.lastrowid
+
+    def reserve(self, limit=1):
+        """
+        Reserves up to `limit` jobs that are ready to run, hiding them from
+        other workers for the visibility timeout. Returns a list of `Job`
+        objects, which must be passed to `complete` or `fail`.
+        """
+        now = time.time()
+        lease = uuid.uuid4().hex
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs whose final delivery timed out are given up on
+            connection.execute(
+                'UPDATE jobs SET status = ?, arguments = NULL, lease = NULL, error = ?, '
+                'updated_at = ? WHERE status = ? AND visible_at <= ? AND attempts >= ?',
+                (FAILED, 'Visibility timeout expired on final attempt', now,
+                 RESERVED, now, self.max_attempts))
+            rows = connection.execute(
+                'SELECT id, method, arguments, request_id, attempts FROM jobs '
+                'WHERE status IN (?, ?) AND visible_at <= ? ORDER BY id LIMIT ?',
+                (PENDING, RESERVED, now, limit)).fetchall()
+            connection.executemany(
+                'UPDATE jobs SET status = ?, lease = ?, visible_at = ?, '
+                'attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                [(RESERVED, lease, now + self.visibility_timeout, now, row[0])
+                 for row in rows])
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        return [Job(self, row[0], row[1], json.loads(row[2]), row[3],
+                    row[4] + 1, lease) for row in rows]
+
+    def complete(self, job, result):
+        """
+        Stores the `(result_objects, unconsumed_data)` tuple of a finished
+        job, in the compact format of `serialization.dumps`, and deletes its
+        arguments. Returns False if the job's reservation had expired and it
+        was already handed to another worker.
+        """
+        result_objects, unconsumed_data = result
+        cursor = self.connection.execute(
+            'UPDATE jobs SET status = ?, result = ?, arguments = NULL, lease = NULL, '
+            'error = NULL, updated_at = ? WHERE id = ? AND lease = ?',
+            (DONE, sqlite3.Binary(serialization.dumps(
+                ResultSet(result_objects, unconsumed_data))),
+             time.time(), job.id, job.lease))
+        return cursor.rowcount == 1
+
+    def fail(self, job, error):
+        """
+        Records an error raised while running a job. The job is retried
+        after the retry delay until it has been attempted `max_attempts`
+        times, after which it is marked as failed and its arguments are
+        deleted.
+        """
+        now = time.time()
+        if job.attempts >= self.max_attempts:
+            status, visible_at = FAILED, now
+        else:
+            status, visible_at = PENDING, now + self.retry_delay
+        cursor = self.connection.execute(
+            'UPDATE jobs SET status = ?, visible_at = ?, '
+            'arguments = CASE WHEN ? THEN NULL ELSE arguments END, lease = NULL, '
+            'error = ?, updated_at = ? WHERE id = ? AND lease = ?',
+            (status, visible_at, status == FAILED, str(error), now, job.id, job.lease))
+        return cursor.rowcount == 1
+
+    def status(self, job_id):
+        row = self.connection.execute(
+            'SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        return row[0]
+
+    def result(self, job_id):
+        """
+        Returns the `(result_objects, unconsumed_data)` tuple of a finished
+        job, None if the job has not finished yet, or raises `JobFailed`.
+        """
+        row = self.connection.execute(
+            'SELECT status, result, error FROM jobs WHERE id = ?',
+            (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        status, result, error = row
+        if status == FAILED:
+            raise JobFailed(job_id, error)
+        if status != DONE:
+            return None
+        result_objects = serialization.loads(result)
+        return (result_objects, result_objects.unconsumed_data)
+
+    def wait(self, job_id, timeout=None, poll_interval=0.1):
+        """
+        Blocks until a job has finished and returns its result. Returns
+        None if `timeout` seconds pass first.
+        """
+        expires = timeout is not None and time.time() + timeout
+        while True:
+            result = self.result(job_id)
+            if result is not None:
+                return result
+            if expires and time.time() >= expires:
+                return None
+            time.sleep(poll_interval)
+
+    def counts(self):
+        """Returns a dictionary of the number of jobs in each status."""
+        return dict(self.connection.execute(
+            'SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def purge(self, older_than):
+        """Deletes finished and failed jobs last updated over `older_than` seconds ago."""
+        cursor = self.connection.execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+            (DONE, FAILED, time.time() - older_than))
+        return cursor.rowcount
+
+
+class Job(object):
+    def __init__(self, queue, id, method, arguments, request_id, attempts, lease):
+        self.queue = queue
+        self.id = id
+        self.method = method
+        self.arguments = arguments
+        self.request_id = request_id
+        self.attempts = attempts
+        self.lease = lease
+
+    def run(self, client):
+        """Calls the job's method on `client` and returns its result."""
+        if self.method.startswith('_'):
+            raise ValueError("'%s' is not a transaction method" % self.method)
+        tokenizer = self.queue.tokenizer
+        args = decode_value(self.arguments['args'], tokenizer)
+        kwargs = decode_value(self.arguments['kwargs'], tokenizer)
+        kwargs['request_id'] = self.request_id
+        return getattr(client, self.method)(*args, **kwargs)
+
+    def __str__(self):
+        return 'Job %s: %s (request %s, attempt %s)' % (
+            self.id, self.method, self.request_id, self.attempts)
+
+
+class Worker(object):
+    """
+    Drains a `JobQueue` using a `PayflowProClient`, within the current
+    process.
+    """
+
+    POLL_INTERVAL = 0.5 # Seconds to sleep when the queue is empty
+
+    def __init__(self, queue, client, batch_size=1, poll_interval=POLL_INTERVAL):
+        self.queue = queue
+        self.client = client
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+    def run_once(self):
+        """Runs the jobs that are ready now and returns how many there were."""
+        jobs = self.queue.reserve(self.batch_size)
+        for job in jobs:
+            try:
+                result = job.run(self.client)
+            except Exception as e:
+                self.client.log.warning(u'%s raised an error - %s' % (job, e))
+                self.queue.fail(job, e)
+            else:
+                if not self.queue.complete(job, result):
+                    self.client.log.warning(
+                        u'%s finished after its reservation expired' % job)
+        return len(jobs)
+
+    def run(self, stop_event=None):
+        """Runs jobs until `stop_event` is set."""
+        while stop_event is None or not stop_event.is_set():
+            if not self.run_once():
+                if stop_event is None:
+                    time.sleep(self.poll_interval)
+                else:
+                    stop_event.wait(self.poll_interval)
+
+
+def _run_worker(path, client_factory, queue_options, worker_options, stop_event):
+    queue = JobQueue(path, **queue_options)
+    try:
+        Worker(queue, client_factory(), **worker_options).run(stop_event)
+    finally:
+        queue.close()
+
+
+class WorkerPool(object):
+    """
+    Runs a number of `Worker` processes against the queue database at
+    `path`. Each process opens its own database connection, and throughput
+    scales with the number of processes until the gateway, rather than the
+    queue, becomes the bottleneck.
+
+    Each process builds its own client by calling `client_factory`, as a
+    client's threads and locks can't be shared with, or sent to, another
+    process. The factory is pickled, along with `queue_options`, when the
+    processes are started with `start_method` 'spawn', the default on
+    macOS and Windows.
+    """
+
+    def __init__(self, path, client_factory, processes=4, queue_options={},
+        worker_options={}, start_method=None):
+
+        self.path = path
+        self.client_factory = client_factory
+        self.processes = processes
+        self.queue_options = queue_options
+        self.worker_options = worker_options
+        self._context = multiprocessing.get_context(start_method)
+        self._stop_event = self._context.Event()
+        self._workers = []
+
+    def start(self):
+        # Create the schema once, before the workers race to do it
+        JobQueue(self.path, **self.queue_options).close()
+        for i in range(self.processes):
+            process = self._context.Process(target=_run_worker, args=(
+                self.path, self.client_factory, self.queue_options,
+                self.worker_options, self._stop_event))
+            process.daemon = True
+            process.start()
+            self._workers.append(process)
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Asks the workers to exit after their current jobs and waits for
+        them. Jobs they had reserved but not run are redelivered after the
+        visibility timeout.
+        """
+        self._stop_event.set()
+        for process in self._workers:
+            process.join(timeout)
+        self._workers = []
@@ -0,0 +1,112 @@
+"""
+Adaptive concurrency limits for the client's dispatcher.
+
+A fixed `max_concurrency` is either too timid when the gateway is fast or
+too aggressive when it is struggling. `AIMDLimit` adjusts the number of
+calls that may be in flight from the outcome of each attempt: the limit
+grows by about one for every limit's worth of successful attempts made
+while there were enough calls to use it fully (additive increase), and is cut by a fraction when
+an attempt fails or takes much longer than usual (multiplicative
+decrease).
+
+Example usage:
+
+    client = PayflowProClient(..., max_concurrency=32,
+                              concurrency_limit=AIMDLimit(initial=4))
+    client.concurrency_limit    # The number of calls allowed right now
+    client.dispatcher.limit.metrics()
+"""
+import threading
+import time
+
+
+class AIMDLimit(object):
+    """
+    An additive-increase, multiplicative-decrease concurrency limit between
+    `min_limit` and `max_limit`, starting at `initial`. The dispatcher sets
+    `max_limit`, and `initial` if it isn't given, to its `max_concurrency`.
+
+    An attempt counts as overloaded if it fails, or if its latency exceeds
+    `latency_threshold` seconds. Without a threshold, the latency is
+    compared with `latency_tolerance` times a baseline that follows the
+    fastest recent attempts, and must also exceed the baseline by
+    `latency_slack` seconds so that jitter on very fast responses is not
+    mistaken for overload. Overloads cut the limit to `backoff` times its
+    value, at most once for the attempts that were already in flight when
+    it was last cut.
+    """
+
+    BASELINE_DRIFT = 0.01 # How quickly the baseline rises towards slower latencies
+
+    def __init__(self, initial=None, min_limit=1, max_limit=None, backoff=0.75,
+        latency_threshold=None, latency_tolerance=2.0, latency_slack=0.05):
+
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+        self.latency_tolerance = latency_tolerance
+        self.latency_slack = latency_slack
+        self.limit = initial
+        self.baseline = None
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = None
+        self._lock = threading.Lock()
+
+    def bind(self, max_concurrency):
+        """Fills in `max_limit` and `initial` from the dispatcher's maximum."""
+        with self._lock:
+            if self.max_limit is None:
+                self.max_limit = max_concurrency
+            if self.limit is None:
+                self.limit = self.max_limit
+            self.limit = min(max(self.limit, self.min_limit), self.max_limit)
+
+    def _overloaded(self, latency, ok):
+        if not ok:
+            return True
+        if latency is None:
+            return False
+        if self.latency_threshold is not None:
+            return latency > self.latency_threshold
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+            return False
+        self.baseline += (latency - self.baseline) * self.BASELINE_DRIFT
+        return latency > self.baseline * self.latency_tolerance \
+            and latency > self.baseline + self.latency_slack
+
+    def update(self, latency, ok, demand):
+        """
+        Records the outcome of an attempt that took `latency` seconds
+        (None if unknown). `demand` is the number of calls in flight,
+        including this one, or waiting for a slot. Returns the new limit.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._overloaded(latency, ok):
+                started = now - (latency or 0)
+                if self._last_decrease is None or started >= self._last_decrease:
+                    self.limit = max(self.limit * self.backoff, self.min_limit)
+                    self.decreases += 1
+                    self._last_decrease = now
+            elif demand >= int(self.limit):
+                # Only grow while the limit is what holds calls back
+                self.limit = min(self.limit + 1.0 / self.limit, self.max_limit)
+                self.increases += 1
+            return self.limit
+
+    def current(self):
+        """Returns the number of calls allowed in flight, as an integer."""
+        return int(self.limit)
+
+    def metrics(self):
+        with self._lock:
+            return dict(
+                limit = self.limit,
+                baseline = self.baseline,
+                increases = self.increases,
+                decreases = self.decreases,
+            )
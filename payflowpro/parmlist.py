@@ -0,0 +1,149 @@
+"""
+Incremental parsing of PARMLIST responses.
+
+`parse_parmlist` needs the whole response as a decoded string. A
+`ParmlistParser` is fed the response body in chunks of bytes as they are
+read from the socket instead, and parses each name and value pair as soon
+as it is complete, so that a long response, such as the payment history of
+a recurring profile, is never held in memory both whole and parsed. It
+also refuses responses larger than `max_bytes`, which protects the client
+from a misbehaving proxy that sends an unbounded body:
+
+    parser = ParmlistParser(max_bytes=1024 * 1024)
+    for chunk in chunks:
+        parser.feed(chunk)
+    results = parser.close()
+
+Values are decoded individually as UTF-8. The lengths given in names such
+as `RESPMSG[8]` are counted in bytes, as the gateway counts them.
+"""
+
+# A name, with an optional length, and the = that ends it
+_NAME_PATTERN = br'([A-Z0-9_]+)(?:\[(\d+)\])?='
+# What could still turn out to be a name once more data arrives
+_PARTIAL_NAME_PATTERN = br'[A-Z0-9_]*(?:\[\d*\]?)?\Z'
+
+_name_re = None
+_partial_name_re = None
+
+
+def _compile():
+    global _name_re, _partial_name_re
+    if _name_re is None:
+        import re
+        _partial_name_re = re.compile(_PARTIAL_NAME_PATTERN)
+        _name_re = re.compile(_NAME_PATTERN)
+
+
+class ResponseTooLarge(Exception):
+    """Raised when a response exceeds the maximum size accepted."""
+
+    def __init__(self, size, max_bytes):
+        Exception.__init__(self,
+            'Response of %s bytes exceeds the maximum of %s bytes' % (size, max_bytes))
+        self.size = size
+        self.max_bytes = max_bytes
+
+
+class ParmlistParser(object):
+    """
+    Parses a PARMLIST fed to it in chunks of bytes. `max_bytes`, if not
+    None, is the largest response accepted. With `keep_text`, the raw
+    response is also kept, and is available as `text` once the parser is
+    closed, for archiving and debugging.
+    """
+
+    def __init__(self, max_bytes=None, keep_text=False):
+        _compile()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.results = {}
+        self.text = None
+        self._chunks = [] if keep_text else None
+        self._buffer = bytearray(b'&')
+        self._name = None # The name of the value being read, if any
+        self._length = None # Its length, if the name gave one
+        self._scanned = 0 # How much of an unsized value has been searched for the next name
+
+    def expect(self, length):
+        """
+        Checks a response length announced in advance, such as by a
+        Content-Length header, so that a response too large to accept can
+        be refused before any of it is read.
+        """
+        if self.max_bytes is not None and length > self.max_bytes:
+            raise ResponseTooLarge(length, self.max_bytes)
+
+    def feed(self, data):
+        """Parses the next chunk of the response."""
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise ResponseTooLarge(self.size, self.max_bytes)
+        if self._chunks is not None:
+            self._chunks.append(bytes(data))
+        self._buffer += data
+        self._parse(False)
+
+    def close(self):
+        """Parses the rest of the response and returns its name and value pairs."""
+        self._parse(True)
+        if self._chunks is not None:
+            self.text = b''.join(self._chunks).decode('utf-8')
+            self._chunks = None
+        return self.results
+
+    def _store(self, end, resume):
+        buffer = self._buffer
+        self.results[self._name] = buffer[:end].decode('utf-8')
+        del buffer[:resume]
+        self._name = self._length = None
+        self._scanned = 0
+
+    def _parse(self, final):
+        buffer = self._buffer
+        while True:
+            if self._name is None:
+                # The buffer starts at the & before the next name
+                index = buffer.find(b'&')
+                while index != -1:
+                    match = _name_re.match(buffer, index + 1)
+                    if match is not None:
+                        break
+                    if not final and _partial_name_re.match(buffer, index + 1):
+                        # Wait to see whether this becomes a name
+                        del buffer[:index]
+                        return
+                    index = buffer.find(b'&', index + 1)
+                else:
+                    # Text that isn't part of any pair is ignored, as
+                    # parse_parmlist does
+                    del buffer[:]
+                    return
+                self._name = match.group(1).decode('ascii').lower()
+                length = match.group(2)
+                self._length = int(length) if length is not None else None
+                del buffer[:match.end()]
+
+            if self._length is not None:
+                if len(buffer) < self._length and not final:
+                    return
+                end = min(self._length, len(buffer))
+                self._store(end, end)
+                continue
+
+            # An unsized value runs to the next & that starts a name
+            index = buffer.find(b'&', self._scanned)
+            while index != -1:
+                if _name_re.match(buffer, index + 1):
+                    break
+                if not final and _partial_name_re.match(buffer, index + 1):
+                    self._scanned = index
+                    return
+                index = buffer.find(b'&', index + 1)
+            else:
+                if not final:
+                    self._scanned = len(buffer)
+                    return
+                self._store(len(buffer), len(buffer))
+                return
+            self._store(index, index)
@@ -0,0 +1,107 @@
+"""
+Local checks of a transaction's parameters, made before it is sent so that
+requests the gateway would reject cost no round trip.
+
+With `PayflowProClient(..., preflight=True)`, every transaction method
+checks that the objects it sends in full, such as the card and amount of
+a sale, have values for their required fields, and that the combined
+parameters include those its transaction type and action require, such
+as ORIGID for a capture. Partial objects passed as `extras`, such as the
+changes made by `profile_modify`, are not checked for required fields. A failed check
+raises `PreflightError` without contacting the gateway:
+
+    try:
+        client.capture(None)
+    except PreflightError as e:
+        e.errors    # {'origid': 'Required parameter'}
+"""
+from .classes import ValidationError
+
+# The parameters required by each (TRXTYPE, ACTION) pair. Each entry is a
+# tuple of alternatives, at least one of which must have a value.
+REQUIRED_PARAMETERS = {
+    ('S', None): (('acct', 'swipe', 'origid', 'baid'), ('amt',)), # Sale
+    ('A', None): (('acct', 'swipe', 'origid', 'baid'), ('amt',)), # Authorization
+    ('D', None): (('origid',),), # Delayed capture
+    ('F', None): (('authcode',), ('acct', 'swipe'), ('amt',)), # Voice authorization
+    ('C', None): (('origid', 'acct', 'swipe'),), # Credit
+    ('V', None): (('origid',),), # Void
+    ('I', None): (('origid', 'custref'),), # Inquiry
+    # Express Checkout and billing agreements
+    ('S', 'S'): (('returnurl',), ('cancelurl',), ('amt',)),
+    ('A', 'S'): (('returnurl',), ('cancelurl',), ('amt',)),
+    ('S', 'G'): (('token',),),
+    ('S', 'D'): (('token', 'baid'), ('amt',)),
+    ('A', 'D'): (('token', 'baid'), ('amt',)),
+    ('A', 'X'): (('token',),),
+    # Recurring billing
+    ('R', 'A'): (('profilename',), ('start',), ('term',), ('payperiod',), ('amt',),
+                 ('acct', 'swipe', 'origid', 'baid')),
+    ('R', 'M'): (('origprofileid',),),
+    ('R', 'R'): (('origprofileid',),),
+    ('R', 'C'): (('origprofileid',),),
+    ('R', 'I'): (('origprofileid',),),
+    ('R', 'P'): (('origprofileid',), ('paymentnum',)),
+}
+
+# Parameters required only when another parameter has a value, by
+# (TRXTYPE, ACTION): tuples of that parameter and the alternatives it
+# requires
+CONDITIONAL_PARAMETERS = {
+    # Express Checkout payments need the buyer's payer ID with the token
+    ('S', 'D'): (('token', ('payerid',)),),
+    ('A', 'D'): (('token', ('payerid',)),),
+    # A credit that doesn't refer to an earlier transaction needs an amount
+    ('C', None): (('acct', ('origid', 'amt')), ('swipe', ('origid', 'amt'))),
+}
+
+
+class PreflightError(ValidationError):
+    """
+    Raised when a transaction fails the pre-flight checks. `errors` maps
+    each missing field, as `ClassName.field`, and each missing parameter to
+    an error message.
+    """
+
+    def __init__(self, errors):
+        message = 'Pre-flight check failed: %s' % ', '.join(
+            '%s (%s)' % (name, errors[name]) for name in sorted(errors))
+        ValidationError.__init__(self, message)
+        Exception.__init__(self, message)
+        self.errors = errors
+
+
+def _missing(value):
+    return value is None or value == ''
+
+
+def check(params, objects=()):
+    """
+    Raises `PreflightError` if one of `objects` lacks a required field, or
+    `params` lacks a parameter required by its TRXTYPE and ACTION. Only
+    the objects the transaction sends in full should be passed as `objects`.
+    """
+    errors = None
+    for obj in objects:
+        obj.is_valid()
+        if obj._errors:
+            if errors is None:
+                errors = {}
+            name = obj.__class__.__name__
+            for field, message in obj._errors.items():
+                errors['%s.%s' % (name, field)] = message
+    key = (params.get('trxtype'), params.get('action'))
+    required = list(REQUIRED_PARAMETERS.get(key, ()))
+    for name, alternatives in CONDITIONAL_PARAMETERS.get(key, ()):
+        if not _missing(params.get(name)):
+            required.append(alternatives)
+    for alternatives in required:
+        for name in alternatives:
+            if not _missing(params.get(name)):
+                break
+        else:
+            if errors is None:
+                errors = {}
+            errors[' or '.join(alternatives)] = 'Required parameter'
+    if errors:
+        raise PreflightError(errors)
@@ -0,0 +1,271 @@
+"""
+A compact, versioned serialization of `PayflowProObject` results, for
+passing them between processes and storing them in caches.
+
+Pickling an object the usual way writes out its `Field` objects along
+with their values. `dumps` writes each object as a class ID and a tuple
+of its field values instead, with the field names of each class written
+once per payload:
+
+    data = dumps((result_objects, unconsumed_data))
+    result_objects, unconsumed_data = loads(data)
+
+`dumps` accepts `PayflowProObject`s, `RecurringPayments` and `ResultSet`s,
+and tuples, lists and dictionaries of them and of plain values. The
+`metadata` of a `ResultSet`, which describes how the request was made, is
+not included. Payloads are encoded with `marshal`, or with `pickle` if
+they hold values `marshal` can't encode, such as `Decimal`s; like
+pickles, they must only be loaded from trusted sources.
+
+Running the module compares the size and speed of `dumps` with those of
+`pickle`, both as it is and as it would be without the `__reduce__` method
+that lets it skip the `Field` objects too:
+
+    $ python -m payflowpro.serialization --count 10000
+"""
+import marshal
+import pickle
+
+from importlib import import_module
+
+from . import classes
+from .classes import field_names
+from .classes import PayflowProObjectBase
+from .classes import RecurringPayment
+from .classes import RecurringPayments
+from .classes import restore_object
+from .classes import ResultSet
+
+MAGIC = b'PFS'
+FORMAT_VERSION = 1
+
+MARSHAL = 0
+PICKLE = 1
+
+_MARSHAL_VERSION = 4
+
+# Classes are written as their position in this list; new classes must
+# only ever be added at the end. Other classes are written by name.
+CLASSES = [getattr(classes, name) for name in (
+    'CreditCard', 'CreditCardPresent', 'BillingType', 'SetPaypal', 'GetPaypal',
+    'DoPaypal', 'Amount', 'Tracking', 'TimeBounds', 'BillToAddress', 'Address',
+    'ShippingAddress', 'CustomerInfo', 'PurchaseInfo', 'Profile', 'Response',
+    'ExpressResponse', 'ProfileResponse', 'VerboseResponse',
+    'AddressVerificationResponse', 'RecurringPayment',
+)]
+_CLASS_IDS = dict((klass, i) for i, klass in enumerate(CLASSES))
+
+# Tags of the encoded tuples; other values are written as they are
+OBJECT = 0 # (OBJECT, schema index, values)
+PAYMENTS = 1 # (PAYMENTS, schema index, (values, ...)[, payment numbers])
+RESULTS = 2 # (RESULTS, items, unconsumed data)
+TUPLE = 3
+LIST = 4
+DICT = 5 # (DICT, keys, values)
+
+
+class _Encoder(object):
+    def __init__(self):
+        self.schema = []
+        self._indexes = {}
+
+    def _schema_index(self, klass):
+        index = self._indexes.get(klass)
+        if index is None:
+            class_id = _CLASS_IDS.get(klass)
+            if class_id is None:
+                class_id = '%s:%s' % (klass.__module__, klass.__qualname__)
+            index = self._indexes[klass] = len(self.schema)
+            self.schema.append((class_id, field_names(klass)))
+        return index
+
+    def _values(self, obj):
+        fields = obj.__dict__['fields']
+        return tuple([fields[name]._value for name in field_names(obj.__class__)])
+
+    def encode(self, value):
+        if isinstance(value, PayflowProObjectBase):
+            return (OBJECT, self._schema_index(value.__class__), self._values(value))
+        if isinstance(value, ResultSet):
+            return (RESULTS, tuple([self.encode(item) for item in value]),
+                    self.encode(value.unconsumed_data))
+        if isinstance(value, RecurringPayments):
+            encoded = (PAYMENTS, self._schema_index(RecurringPayment),
+                       tuple([self._values(payment) for payment in value]))
+            if value.numbers is not None:
+                encoded += (tuple(value.numbers),)
+            return encoded
+        if isinstance(value, tuple):
+            return (TUPLE, tuple([self.encode(item) for item in value]))
+        if isinstance(value, list):
+            return (LIST, tuple([self.encode(item) for item in value]))
+        if isinstance(value, dict):
+            return (DICT, tuple(value), tuple([self.encode(item) for item in value.values()]))
+        return value
+
+
+def _resolve_class(class_id):
+    if isinstance(class_id, int):
+        try:
+            return CLASSES[class_id]
+        except IndexError:
+            raise ValueError('Unknown class ID %d' % class_id)
+    module, name = class_id.split(':')
+    klass = import_module(module)
+    for part in name.split('.'):
+        klass = getattr(klass, part)
+    if not (isinstance(klass, type) and issubclass(klass, PayflowProObjectBase)):
+        raise ValueError("'%s' is not a PayflowProObject class" % class_id)
+    return klass
+
+
+class _Decoder(object):
+    def __init__(self, schema):
+        self.schema = []
+        for class_id, names in schema:
+            klass = _resolve_class(class_id)
+            for name in names:
+                if name not in klass.base_fields:
+                    raise ValueError("%s has no field '%s'" % (klass.__name__, name))
+            self.schema.append((klass, names))
+
+    def decode(self, value):
+        if not isinstance(value, tuple):
+            return value
+        tag = value[0]
+        if tag == OBJECT:
+            klass, names = self.schema[value[1]]
+            return restore_object(klass, names, value[2])
+        if tag == RESULTS:
+            return ResultSet([self.decode(item) for item in value[1]],
+                             self.decode(value[2]))
+        if tag == PAYMENTS:
+            klass, names = self.schema[value[1]]
+            return RecurringPayments(payments=[
+                restore_object(klass, names, values) for values in value[2]],
+                numbers=list(value[3]) if len(value) > 3 else None)
+        if tag == TUPLE:
+            return tuple([self.decode(item) for item in value[1]])
+        if tag == LIST:
+            return [self.decode(item) for item in value[1]]
+        if tag == DICT:
+            return dict(zip(value[1], [self.decode(item) for item in value[2]]))
+        raise ValueError('Unknown tag %r' % (tag,))
+
+
+def dumps(value):
+    """Serializes `value` into bytes that `loads` converts back."""
+    encoder = _Encoder()
+    body = encoder.encode(value)
+    payload = (tuple(encoder.schema), body)
+    try:
+        return MAGIC + bytes([FORMAT_VERSION, MARSHAL]) + marshal.dumps(payload, _MARSHAL_VERSION)
+    except ValueError:
+        # A value marshal doesn't support
+        return MAGIC + bytes([FORMAT_VERSION, PICKLE]) + \
+            pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data):
+    """Recreates a value serialized by `dumps`."""
+    data = bytes(data)
+    if data[:len(MAGIC)] != MAGIC or len(data) < len(MAGIC) + 2:
+        raise ValueError('Not a serialized PayflowProObject payload')
+    version, codec = data[len(MAGIC)], data[len(MAGIC) + 1]
+    if version > FORMAT_VERSION:
+        raise ValueError('Unsupported serialization format version %d' % version)
+    body = data[len(MAGIC) + 2:]
+    if codec == MARSHAL:
+        schema, value = marshal.loads(body)
+    elif codec == PICKLE:
+        schema, value = pickle.loads(body)
+    else:
+        raise ValueError('Unknown codec %d' % codec)
+    return _Decoder(schema).decode(value)
+
+
+def _sample_results():
+    from .client import parse_parmlist
+    from .classes import parse_parameters
+    parmlist = ('RESULT=0&PNREF=V19A2E42B0F1&RESPMSG=Approved&AUTHCODE=010010'
+        '&AVSADDR=Y&AVSZIP=N&IAVS=N&CVV2MATCH=Y&PPREF=3JN35912TW398735C'
+        '&CORRELATIONID=4a7e3b1c4a8f5&PROCAVS=A&PROCCVV2=M&TRANSSTATE=8'
+        '&PROFILEID=RT0000000001&RPREF=R7D50A0A1DA0'
+        '&P_RESULT1=0&P_PNREF1=V18A2F5C2F47&P_TRANSTATE1=8&P_TENDER1=C'
+        '&P_TRANSTIME1=19-Oct-26 04:38 AM&P_AMT1=15.00'
+        '&P_RESULT2=12&P_PNREF2=V18A2F5C2F48&P_TRANSTATE2=1&P_TENDER2=C'
+        '&P_TRANSTIME2=19-Nov-26 04:38 AM&P_AMT2=15.00')
+    return parse_parameters(parse_parmlist(parmlist))
+
+
+def _set_state(obj, state):
+    obj.__dict__.update(state)
+
+
+def _pickle_fields(value):
+    # Pickles objects with their Field objects, as pickle would without
+    # PayflowProObjectBase.__reduce__
+    import copyreg
+    import io
+
+    class Pickler(pickle.Pickler):
+        def reducer_override(self, obj):
+            if isinstance(obj, PayflowProObjectBase):
+                return (copyreg.__newobj__, (obj.__class__,), obj.__dict__,
+                        None, None, _set_state)
+            return NotImplemented
+
+    f = io.BytesIO()
+    Pickler(f, pickle.HIGHEST_PROTOCOL).dump(value)
+    return f.getvalue()
+
+
+def benchmark(count=10000):
+    """
+    Serializes `count` copies of a typical result with `dumps`, with
+    `pickle`, and with `pickle` writing out the `Field` objects, and returns
+    the size and time taken by each.
+    """
+    import time
+
+    values = [_sample_results() for i in range(count)]
+    stats = {}
+    for name, dump, load in (
+            ('compact', dumps, loads),
+            ('pickle', lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+             pickle.loads),
+            ('fields', _pickle_fields, pickle.loads)):
+        started = time.perf_counter()
+        payloads = [dump(value) for value in values]
+        dumped = time.perf_counter()
+        for payload in payloads:
+            load(payload)
+        loaded = time.perf_counter()
+        stats[name] = dict(
+            bytes = sum(map(len, payloads)) // count,
+            dumps = (dumped - started) / count,
+            loads = (loaded - dumped) / count,
+        )
+    return stats
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m payflowpro.serialization',
+        description='Compare the compact serialization of results with pickle.')
+    parser.add_argument('--count', type=int, default=10000,
+        help='number of results to serialize')
+    args = parser.parse_args(argv)
+
+    stats = benchmark(args.count)
+    print('%-8s %8s %12s %12s' % ('format', 'bytes', 'dumps (us)', 'loads (us)'))
+    for name in ('compact', 'pickle', 'fields'):
+        print('%-8s %8d %12.1f %12.1f' % (name, stats[name]['bytes'],
+            stats[name]['dumps'] * 1e6, stats[name]['loads'] * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
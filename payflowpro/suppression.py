@@ -0,0 +1,132 @@
+"""
+Suppression of duplicate payment submissions, such as those caused by a
+double-clicked "Pay" button or by a client retrying with a new request ID.
+
+With `PayflowProClient(..., duplicates=DuplicateSuppressor(window=60))`,
+a `sale` or `authorization` that repeats one made in the last `window`
+seconds -- same card, amount, currency and merchant references -- is not
+sent. Instead it waits for the original call if that is still in flight,
+and returns the original result.
+
+Only a keyed hash of the identifying parameters is kept, never the card
+number itself. Declined payments are forgotten, so that they may be
+retried straight away.
+"""
+import hashlib
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError
+from decimal import Decimal
+from decimal import InvalidOperation
+
+from .classes import normalize_account
+from .classes import Response
+from .deadline import DeadlineExceeded
+
+# The parameters that identify a payment as a repeat of another
+KEY_PARAMETERS = ('trxtype', 'tender', 'acct', 'swipe', 'expdate', 'origid', 'baid',
+                  'amt', 'currency', 'custref', 'invnum', 'ponum')
+
+# Results that are remembered: approved, or held for fraud review
+KEEP_RESULTS = ('0', '126', '127')
+
+
+def _normalize(name, value):
+    if value is None or value == '':
+        return ''
+    if name == 'amt':
+        try:
+            return str(Decimal(str(value)).normalize())
+        except InvalidOperation:
+            pass
+    elif name == 'acct':
+        value = normalize_account(value)
+    return str(value)
+
+
+class _Entry(object):
+    def __init__(self, expires):
+        self.expires = expires
+        self.future = Future()
+
+
+class DuplicateSuppressor(object):
+    """
+    Remembers payments for `window` seconds, and at most `capacity` of them;
+    the oldest are forgotten first.
+    """
+
+    def __init__(self, window=60, capacity=100000):
+        self.window = window
+        self.capacity = capacity
+        self.suppressed = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Hashes are keyed with a per-process secret, so the index can't be
+        # used to confirm guesses at card numbers
+        self._secret = os.urandom(32)
+
+    def key(self, params):
+        """Returns the hash identifying the payment described by `params`."""
+        digest = hashlib.blake2b(key=self._secret, digest_size=20)
+        for name in KEY_PARAMETERS:
+            digest.update(_normalize(name, params.get(name)).encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.digest()
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries and next(iter(entries.values())).expires <= now:
+            entries.popitem(last=False)
+
+    def run(self, params, deadline, fn, /, *args, **kwargs):
+        """
+        Returns the result of `fn(*args, **kwargs)` for the payment
+        described by `params`, or the result of the same payment made in
+        the last `window` seconds. Waiting for a payment still in flight
+        raises `DeadlineExceeded` if `deadline` passes first.
+        """
+        key = self.key(params)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _Entry(now + self.window)
+                if len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+            else:
+                self.suppressed += 1
+
+        if not owner:
+            try:
+                return entry.future.result(
+                    None if deadline is None else max(deadline.remaining(), 0))
+            except TimeoutError:
+                raise DeadlineExceeded(
+                    'Deadline exceeded waiting for a duplicate payment', deadline)
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._forget(key, entry)
+            entry.future.set_exception(e)
+            raise
+        response = result[0].get(Response)
+        if response is None or response.result not in KEEP_RESULTS:
+            self._forget(key, entry)
+        entry.future.set_result(result)
+        return result
+
+    def _forget(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,60 @@
+r"""
+>>> import os, shutil, tempfile
+>>> from payflowpro.classes import CreditCard, Amount
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.archive import ParmlistArchive, redact_parmlist, replay, main
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> # Card numbers, security codes and passwords are masked in place.
+>>> redact_parmlist('ACCT[16]=4111111111111111&CVV2=123&PWD[5]=p&s=w&USER=me')
+'ACCT[16]=XXXXXXXXXXXX1111&CVV2=XXX&PWD[5]=XXXXX&USER=me'
+
+>>> # Lengths are counted in bytes, so non-ASCII values are masked exactly.
+>>> request = PayflowProClient('paypal', 'foobar', 'me', u'p\xe4ssw\xf6rd&x')._build_parmlist(
+...     dict(pwd=u'p\xe4ssw\xf6rd&x', user='me', acct='4111111111111111'))
+>>> redact_parmlist(request)
+'ACCT[16]=XXXXXXXXXXXX1111&PWD[12]=XXXXXXXXXXXX&USER[2]=me'
+
+>>> gateway = StandInGateway().start()
+>>> directory = tempfile.mkdtemp()
+>>> archive = ParmlistArchive(directory, segment_size=1024, compress=True)
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url,
+...     archive=archive)
+
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114", cvv2="123")
+>>> for i in range(20):
+...     responses, unconsumed_data = client.sale(credit_card, Amount(amt=i + 1),
+...                                              request_id=1000 + i)
+>>> len(archive.segments()) > 1
+True
+
+>>> # Exchanges can be found by request ID or PNREF.
+>>> exchange = archive.lookup(request_id=1005)
+>>> exchange.pnref, exchange.response
+('V00000000005', 'RESULT=0&PNREF=V00000000005&RESPMSG=Approved&AUTHCODE=010101')
+>>> 'ACCT[16]=XXXXXXXXXXXX1111' in exchange.request, 'password123' in exchange.request
+(True, False)
+>>> archive.lookup(pnref=responses[0].pnref).request_id
+'1019'
+>>> archive.lookup(request_id=1) is None
+True
+
+>>> # Replaying re-parses every archived response.
+>>> stats = replay(directory)
+>>> stats['records'], stats['unconsumed'], stats['errors']
+(20, 0, 0)
+>>> main(['show', directory, '--pnref', 'V00000000000'])
+ArchivedExchange 1000 (V00000000000) at ...
+Request:  ACCT[16]=XXXXXXXXXXXX1111&AMT[1]=1&CVV2[3]=XXX&EXPDATE[4]=0114&PARTNER[6]=paypal&PWD[11]=XXXXXXXXXXX&TENDER[1]=C&TRXTYPE[1]=S&USER[6]=foobar&VENDOR[6]=foobar
+Response: RESULT=0&PNREF=V00000000000&RESPMSG=Approved&AUTHCODE=010101
+0
+
+>>> archive.close()
+>>> shutil.rmtree(directory)
+>>> gateway.stop()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
@@ -0,0 +1,35 @@
+r"""
+>>> from payflowpro.classes import CreditCard
+>>> from payflowpro.cards import check_accounts, validate_accounts, \
+...     partition_cards, normalize_accounts, VALID, INVALID_FORMAT, \
+...     INVALID_LENGTH, INVALID_CHECKSUM, UNKNOWN_RANGE
+
+>>> accounts = ["4111 1111-1111 1111", 5555555555554444, "378282246310005",
+...             "4111111111111112", "41111", "4111-abcd", None,
+...             "9111111111111110", "1234567890123456789012"]
+>>> normalize_accounts(accounts)[:3]
+['4111111111111111', '5555555555554444', '378282246310005']
+
+>>> # The pure Python and NumPy checks agree.
+>>> expected = [VALID, VALID, VALID, INVALID_CHECKSUM, INVALID_LENGTH,
+...             INVALID_FORMAT, INVALID_FORMAT, UNKNOWN_RANGE, INVALID_LENGTH]
+>>> check_accounts(accounts, use_numpy=False) == expected
+True
+>>> try:
+...     import numpy
+... except ImportError:
+...     numpy = None
+>>> numpy is None or list(check_accounts(accounts, use_numpy=True)) == expected
+True
+>>> [bool(ok) for ok in validate_accounts(accounts)]
+[True, True, True, False, False, False, False, False, False]
+
+>>> # Cards that would be declined are kept away from the gateway.
+>>> valid, invalid = partition_cards([CreditCard(acct=a) for a in accounts[:5]])
+>>> [card.acct for card in invalid]
+['4111111111111112', '41111']
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod()
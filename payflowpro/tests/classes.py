@@ -0,0 +1,79 @@
+r"""
+>>> from payflowpro.classes import CreditCard, Amount, Profile, Response, \
+...                                 PayflowProObject, Field, Address, \
+...                                 GetPaypal, RecurringPayments, parse_parameters
+
+>>> # Fields can be given as keyword arguments or as a data dictionary.
+>>> credit_card = CreditCard(acct="4111 1111-1111 1111", expdate="0114")
+>>> sorted(credit_card.data.items())
+[('acct', '4111111111111111'), ('expdate', '0114'), ('tender', 'C')]
+>>> CreditCard(data=dict(acct=5555555555554444, cvv2="123")).cvv2
+'123'
+>>> CreditCard(swipe="123")
+Traceback (most recent call last):
+...
+TypeError: __init__() got an unexpected keyword argument 'swipe'
+
+>>> # Only fields with a true value are part of the data...
+>>> credit_card["tender"]
+'C'
+>>> credit_card["cvv2"]
+Traceback (most recent call last):
+...
+KeyError: 'cvv2'
+
+>>> # ...except for Amount, which keeps every field, and Profile, which
+>>> # keeps fields set to zero.
+>>> sorted(Amount(amt=0).data.items())
+[('amt', 0), ('currency', None), ('dutyamt', None), ('freightamt', None), ('taxamt', None)]
+>>> Profile(term=0, desc="").data
+{'term': 0}
+>>> Profile(term=0)["term"]
+0
+
+>>> # Required fields without a value are reported as errors.
+>>> CreditCard().errors
+{'acct': 'Required Field'}
+>>> sorted(Profile(term=0).errors)
+['payperiod', 'profilename', 'start']
+>>> Response(result="0").errors
+{}
+
+>>> # Subclasses that define their own data keep it.
+>>> class Custom(PayflowProObject):
+...     foo = Field(required=True)
+...     def _get_data(self):
+...         return dict(foo=self.fields['foo'].value, bar='baz')
+...     data = property(_get_data)
+>>> Custom(foo=None)["bar"], Custom().errors
+('baz', {'foo': 'Required Field'})
+
+>>> # Parsed responses are lists with constant-time lookups.
+>>> results, unconsumed_data = parse_parameters(dict(result='0', pnref='V19A2E42B0F1',
+...     respmsg='Approved', token='EC-17C76533PL706494P', p_result1='0',
+...     p_pnref1='V18A2E42B0F2', p_amt1='30.00', unknown='1'))
+>>> results[0] is results[Response], results.get(Address)
+(True, None)
+>>> results[GetPaypal].token, results.pnref, results.token
+('EC-17C76533PL706494P', 'V19A2E42B0F1', 'EC-17C76533PL706494P')
+>>> len(results[RecurringPayments]), results.unconsumed_data
+(1, {'unknown': '1'})
+>>> results[Address]
+Traceback (most recent call last):
+...
+KeyError: <class 'payflowpro.classes.Address'>
+>>> results.append(Address(street="2842 Magnolia St."))
+>>> results[Address].street, results.street
+('2842 Magnolia St.', '2842 Magnolia St.')
+>>> results.clear()
+>>> results.get(Address), results.get(Response), hasattr(results, 'pnref')
+(None, None, False)
+>>> results.append(Address(street="1 Main St."))
+>>> results *= 2
+>>> len(results), results[Address].street
+(2, '1 Main St.')
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,50 @@
+r"""
+>>> import time
+>>> from payflowpro.classes import CreditCard, Amount
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.deadline import Deadline, DeadlineExceeded
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> gateway = StandInGateway(delay=1).start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url)
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114")
+
+>>> # The deadline caps each attempt's socket timeout, and there are no
+>>> # retries once it has passed.
+>>> started = time.monotonic()
+>>> client.sale(credit_card, Amount(amt=1), deadline=0.3)
+Traceback (most recent call last):
+...
+DeadlineExceeded: ...
+>>> time.monotonic() - started < 0.9, len(gateway.requests)
+(True, 1)
+>>> gateway.requests[0][1]['X-VPS-CLIENT-TIMEOUT']
+'1'
+
+>>> # A deadline that has already passed costs no round trip at all.
+>>> client.capture('V19A2E42B0F1', deadline=Deadline.at(time.time() - 1))
+Traceback (most recent call last):
+...
+DeadlineExceeded: ...
+>>> len(gateway.requests)
+1
+
+>>> # Batch calls share the deadline; calls that do not make it in time fail.
+>>> gateway.delay = 0
+>>> results = client.batch([('void', ('V19A2E42B0F1',))] * 3, deadline=5)
+>>> [responses[0].respmsg for responses, unconsumed_data in results]
+['Approved', 'Approved', 'Approved']
+>>> gateway.requests[-1][1]['X-VPS-Timeout']
+'4'
+>>> results = client.batch([('void', ('V19A2E42B0F1',))], deadline=Deadline.after(-1),
+...                        return_exceptions=True)
+>>> results[0].__class__.__name__
+'DeadlineExceeded'
+
+>>> gateway.stop()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS | doctest.IGNORE_EXCEPTION_DETAIL)
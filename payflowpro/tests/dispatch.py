@@ -0,0 +1,102 @@
+r"""
+>>> import threading
+>>> from payflowpro.classes import CreditCard, Amount
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.deadline import Deadline
+>>> from payflowpro.dispatch import Dispatcher, INTERACTIVE, NORMAL, BACKGROUND
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> gate = threading.Event()
+>>> started = []
+>>> def call(name):
+...     started.append(name)
+...     gate.wait()
+...     return name
+
+>>> # With a single slot, waiting calls are started in proportion to the
+>>> # weights of their lanes.
+>>> dispatcher = Dispatcher(1, lanes=((INTERACTIVE, 8, 0), (NORMAL, 4, 0),
+...                                   (BACKGROUND, 1, 0)))
+>>> first = dispatcher.submit(call, 'first')
+>>> futures = [dispatcher.schedule(BACKGROUND, call, 'b%d' % i) for i in range(3)]
+>>> futures += [dispatcher.schedule(NORMAL, call, 'n%d' % i) for i in range(5)]
+>>> futures += [dispatcher.schedule(INTERACTIVE, call, 'i%d' % i) for i in range(3)]
+>>> dispatcher.metrics()['background']
+{'active': 0, 'waiting': 3, 'started': 0}
+>>> gate.set()
+>>> results = [future.result() for future in futures]
+>>> started
+['first', 'i0', 'i1', 'i2', 'n0', 'n1', 'n2', 'b0', 'n3', 'n4', 'b1', 'b2']
+>>> dispatcher.shutdown()
+
+>>> # Reserved slots can't be taken by other lanes: background calls only
+>>> # get one of the two slots, and interactive calls start straight away.
+>>> gate.clear()
+>>> del started[:]
+>>> dispatcher = Dispatcher(2)
+>>> futures = [dispatcher.schedule(BACKGROUND, call, 'b%d' % i) for i in range(3)]
+>>> interactive = dispatcher.schedule(INTERACTIVE, call, 'i0')
+>>> while len(started) < 2:
+...     threading.Event().wait(0.01)
+>>> sorted(started)
+['b0', 'i0']
+>>> dispatcher.metrics()['background']
+{'active': 1, 'waiting': 2, 'started': 1}
+
+>>> # Direct calls wait for a slot too, unless their deadline passes first
+>>> with dispatcher.slot(INTERACTIVE, Deadline.after(0.1)):
+...     pass
+Traceback (most recent call last):
+...
+DeadlineExceeded: Deadline exceeded waiting for a slot in the interactive lane
+>>> dispatcher.schedule('urgent', call, 'u0')
+Traceback (most recent call last):
+...
+ValueError: Unknown priority 'urgent'
+>>> gate.set()
+>>> results = [future.result() for future in futures + [interactive]]
+>>> dispatcher.metrics()['interactive']
+{'active': 0, 'waiting': 0, 'started': 1}
+>>> dispatcher.shutdown()
+
+>>> # By default, direct calls on a client are not limited: eight calls
+>>> # made at once from eight threads all run in parallel.
+>>> import time
+>>> gateway = StandInGateway(delay=0.5).start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url)
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114")
+>>> threads = [threading.Thread(target=client.sale, args=(credit_card, Amount(amt=1)))
+...            for i in range(8)]
+>>> began = time.monotonic()
+>>> for thread in threads:
+...     thread.start()
+>>> for thread in threads:
+...     thread.join()
+>>> len(gateway.requests), time.monotonic() - began < 1
+(8, True)
+>>> client.dispatcher.metrics()['normal']['started']
+0
+>>> gateway.stop()
+
+>>> # With a max_concurrency, the client's calls take slots in the lane
+>>> # given by `priority`, and calls made from a batch reuse the slot of
+>>> # the batch call.
+>>> gateway = StandInGateway().start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url,
+...     max_concurrency=4)
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt=1),
+...                                          priority=INTERACTIVE)
+>>> results = client.batch([('sale', (credit_card, Amount(amt=2)))] * 4,
+...                        priority=BACKGROUND)
+>>> metrics = client.dispatcher.metrics()
+>>> metrics['interactive']['started'], metrics['background']['started']
+(1, 4)
+>>> client.dispatcher.shutdown()
+>>> gateway.stop()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS | doctest.IGNORE_EXCEPTION_DETAIL)
@@ -0,0 +1,107 @@
+r"""
+>>> import os, shutil, tempfile
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.dunning import DunningScheduler
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> # Profiles RP1 to RP6 are billed monthly; every third one has a failed
+>>> # second payment, and the retries of RP3's keep being declined.
+>>> def gateway_responder(parameters, pnref):
+...     profile_id = parameters['origprofileid']
+...     if parameters['action'] == 'P':
+...         result = '12' if profile_id == 'RP3' else '0'
+...         return 'RESULT=%s&PNREF=%s&RPREF=R%s' % (result, pnref, pnref)
+...     failed = int(profile_id[2:]) % 3 == 0
+...     return 'RESULT=0&RPREF=R%s&PROFILEID=%s&' % (pnref, profile_id) + '&'.join(
+...         'P_RESULT%d=%s&P_PNREF%d=V%s%d&P_TRANSTATE%d=%s&P_TENDER%d=C'
+...         '&P_TRANSTIME%d=19-Oct-26 04:38 AM&P_AMT%d=15.00' % (
+...         n, '12' if failed and n == 2 else '0', n, profile_id, n,
+...         n, '1' if failed and n == 2 else '8', n, n, n) for n in (1, 2, 3))
+>>> gateway = StandInGateway(responder=gateway_responder).start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url)
+>>> directory = tempfile.mkdtemp()
+>>> scheduler = DunningScheduler(os.path.join(directory, 'dunning.db'), client,
+...     retry_schedule=(100, 200), scan_concurrency=4, batch_size=2, rate=1000)
+
+>>> # Scans read the profile IDs as they go, and index the failed payments.
+>>> profile_ids = iter(['RP%d' % i for i in range(1, 7)])
+>>> scheduler.scan(profile_ids, now=1000)
+{'profiles': 6, 'failed': 2, 'errors': 0}
+>>> [(p['payment_number'], p['pnref'], p['status'], p['next_retry_at'])
+...  for p in scheduler.payments('RP3')]
+[(2, 'VRP32', 'pending', 1100.0)]
+>>> inquiries = [parameters for parameters, headers in gateway.requests]
+>>> len(inquiries), inquiries[0]['paymenthistory']
+(6, 'Y')
+
+>>> # Scanning again adds nothing new.
+>>> scheduler.scan(['RP3', 'RP6'], now=1050)['failed']
+0
+
+>>> # Nothing is retried before it is due...
+>>> scheduler.retry_due(now=1099)
+{'retried': 0, 'recovered': 0, 'exhausted': 0, 'errors': 0}
+
+>>> # ...and then each failed payment is retried with profile_pay.
+>>> scheduler.retry_due(now=1100)
+{'retried': 2, 'recovered': 1, 'exhausted': 0, 'errors': 0}
+>>> sorted((p['origprofileid'], p['paymentnum']) for p, h in gateway.requests[-2:])
+[('RP3', '2'), ('RP6', '2')]
+>>> scheduler.counts()
+{'pending': 1, 'recovered': 1}
+>>> [(p['status'], p['retries'], p['next_retry_at'], p['last_result'])
+...  for p in scheduler.payments('RP3')]
+[('pending', 1, 1300.0, '12')]
+
+>>> # A payment is given up on once its retries are used up.
+>>> scheduler.retry_due(now=1300)
+{'retried': 1, 'recovered': 0, 'exhausted': 1, 'errors': 0}
+>>> scheduler.retry_due(now=10000)['retried']
+0
+
+>>> # A retry cut short by a crash is sent again once its lease expires,
+>>> # with the same request ID, so the gateway doesn't take a second payment.
+>>> scheduler.connection.execute("UPDATE failed_payments SET status = 'pending', "
+...     "retries = 0, next_retry_at = 0 WHERE profile_id = 'RP3'").rowcount
+1
+>>> [claimed[:2] for claimed in scheduler.claim(10, now=2000)]
+[('RP3', 2)]
+>>> request_id = scheduler.payments('RP3')[0]['request_id']
+>>> scheduler.retry_due(now=2000 + scheduler.lease_timeout - 1)['retried']
+0
+>>> scheduler.retry_due(now=2000 + scheduler.lease_timeout)['retried']
+1
+>>> gateway.requests[-1][1]['X-VPS-REQUEST-ID'] == request_id
+True
+
+>>> # Errors leave the payment to be retried with the same request ID.
+>>> gateway.stop()
+>>> client.MAX_RETRY_COUNT = 1
+>>> scheduler.connection.execute("UPDATE failed_payments SET status = 'pending', "
+...     "retries = 0, next_retry_at = 0 WHERE profile_id = 'RP3'").rowcount
+1
+>>> scheduler.retry_due(now=3000)
+{'retried': 1, 'recovered': 0, 'exhausted': 0, 'errors': 1}
+>>> [(p['status'], p['retries'], p['errors'], p['last_error'][:30])
+...  for p in scheduler.payments('RP3')]
+[('retrying', 0, 1, '[Errno 111] Connection refused')]
+
+>>> # But not forever: after `max_errors` errors in a row it is given up on.
+>>> scheduler.max_errors = 2
+>>> scheduler.retry_due(now=3000 + scheduler.lease_timeout)
+{'retried': 1, 'recovered': 0, 'exhausted': 1, 'errors': 1}
+>>> [(p['status'], p['retries'], p['errors']) for p in scheduler.payments('RP3')]
+[('exhausted', 0, 2)]
+>>> scheduler.retry_due(now=10000)['retried']
+0
+>>> scheduler.scan(['RP1'])
+{'profiles': 1, 'failed': 0, 'errors': 1}
+
+>>> scheduler.close()
+>>> shutil.rmtree(directory)
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
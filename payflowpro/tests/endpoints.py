@@ -0,0 +1,83 @@
+r"""
+>>> from payflowpro.classes import Amount, CreditCard
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> down = StandInGateway().start()
+>>> down.stop()
+>>> slow = StandInGateway(delay=0.1).start()
+>>> fast = StandInGateway().start()
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114")
+
+>>> # An endpoint that refuses connections is failed over from, and the
+>>> # retry carries the same request ID
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123',
+...     endpoints=[down.url, fast.url], redirect=PayflowProClient.REDIRECT_LIVE)
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt=1), request_id=42)
+>>> [(timings.url == down.url, timings.error is not None)
+...  for timings in responses.metadata['attempts']]
+[(True, True), (False, False)]
+>>> fast.requests[-1][1]['X-VPS-REQUEST-ID']
+'42'
+>>> [(status['healthy'], status['requests'], status['failures'])
+...  for status in client.endpoints.status()]
+[(False, 1, 1), (True, 1, 0)]
+
+>>> # The failed endpoint stays out of rotation during its cooldown
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt=2))
+>>> len(responses.metadata['attempts']), len(fast.requests)
+(1, 2)
+>>> client.redirect == PayflowProClient.REDIRECT_LIVE, client.url_base == down.url
+(True, True)
+
+>>> # The redirect can't be told from the endpoints, so it must be given
+>>> PayflowProClient(partner='paypal', vendor='foobar', username='foobar',
+...     password='password123', endpoints=[PayflowProClient.URL_BASE_LIVE])
+Traceback (most recent call last):
+...
+ValueError: A redirect is required with endpoints
+
+>>> # Each endpoint is measured, then requests go to the fastest
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123',
+...     endpoints=[slow.url, fast.url], redirect=PayflowProClient.REDIRECT_LIVE)
+>>> for i in range(5):
+...     responses, unconsumed_data = client.sale(credit_card, Amount(amt=i + 1))
+>>> [status['requests'] for status in client.endpoints.status()]
+[1, 4]
+>>> slow_latency, fast_latency = [status['latency'] for status in client.endpoints.status()]
+>>> slow_latency > 0.1 > fast_latency
+True
+
+>>> # When every endpoint is down, they are still tried
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=down.url)
+>>> client.sale(credit_card, Amount(amt=1))
+Traceback (most recent call last):
+...
+ConnectionRefusedError: [Errno 111] Connection refused
+>>> client.endpoints.status()[0]['failures'] == client.MAX_RETRY_COUNT
+True
+
+>>> # An endpoint that was connected to but failed to answer in time stays
+>>> # in rotation, whether the request was hedged or not
+>>> from payflowpro.hedging import HedgingPolicy
+>>> for hedging in (None, HedgingPolicy(delay=5)):
+...     client = PayflowProClient(partner='paypal', vendor='foobar',
+...         username='foobar', password='password123', timeout_secs=0.05,
+...         url_base=slow.url, hedging=hedging)
+...     client.MAX_RETRY_COUNT = 1
+...     try:
+...         client.sale(credit_card, Amount(amt=1))
+...     except Exception as e:
+...         print(e.__class__.__name__, client.endpoints.status()[0]['healthy'])
+TimeoutError True
+TimeoutError True
+>>> slow.stop()
+>>> fast.stop()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS | doctest.IGNORE_EXCEPTION_DETAIL)
@@ -0,0 +1,66 @@
+r"""
+>>> import threading, time
+>>> from payflowpro.classes import CreditCard, Amount
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.hedging import HedgingPolicy
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> # The first copy of every request is slow, the second one fast.
+>>> gateway = StandInGateway(delay=lambda n: 2 if n % 2 else 0).start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url,
+...     hedging=HedgingPolicy(delay=0.1))
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114")
+
+>>> started = time.monotonic()
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt=1),
+...                                          request_id=42)
+>>> time.monotonic() - started < 1, responses[0].respmsg
+(True, 'Approved')
+
+>>> # Both copies carried the same request ID, so the gateway saw one sale.
+>>> [headers['X-VPS-REQUEST-ID'] for parameters, headers in gateway.requests]
+['42', '42']
+>>> len(gateway.responses)
+1
+>>> metrics = client.hedging.metrics()
+>>> metrics['requests'], metrics['hedged'], metrics['hedge_wins'], metrics['win_rate']
+(1, 1, 1, 1.0)
+
+>>> # The slow copy is cancelled once the fast one has answered, so its
+>>> # thread doesn't wait for the response.
+>>> time.sleep(0.2)
+>>> [thread for thread in threading.enumerate() if thread.name == 'payflowpro-hedge']
+[]
+
+>>> # Without a fixed delay, the hedge delay follows observed latencies.
+>>> policy = HedgingPolicy(percentile=0.9, min_samples=10)
+>>> policy.hedge_delay() is None
+True
+>>> for latency in range(1, 11):
+...     policy.observe(latency / 10.0)
+>>> policy.hedge_delay()
+1.0
+
+>>> # Until then, requests are sent from the calling thread.
+>>> HedgingPolicy().run(lambda: threading.current_thread() is threading.main_thread())
+True
+
+>>> # A hedge only gets the time left before the deadline, so a hedged call
+>>> # still gives up when the deadline passes.
+>>> gateway.delay = 3
+>>> client.hedging = HedgingPolicy(delay=0.5)
+>>> started = time.monotonic()
+>>> client.sale(credit_card, Amount(amt=1), deadline=1)
+Traceback (most recent call last):
+...
+DeadlineExceeded: Deadline exceeded after 1 attempts - ...
+>>> time.monotonic() - started < 1.4
+True
+
+>>> gateway.stop()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS | doctest.IGNORE_EXCEPTION_DETAIL)
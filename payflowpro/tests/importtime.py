@@ -0,0 +1,23 @@
+r"""
+>>> from payflowpro import importtime
+
+>>> # Importing the client leaves the networking, logging, regular
+>>> # expression and thread pool modules for the first call to import.
+>>> loaded = importtime.loaded_modules('payflowpro.client')
+>>> 'payflowpro.client' in loaded
+True
+>>> [name for name in importtime.DEFERRED_MODULES if name in loaded]
+[]
+
+>>> # The deferred imports still happen when they are needed.
+>>> import sys
+>>> from payflowpro.classes import CreditCard
+>>> from payflowpro.client import parse_parmlist, PayflowProClient
+>>> parse_parmlist('RESULT=0&RESPMSG=Approved&P_AMT[5]=1.00')
+{'result': '0', 'respmsg': 'Approved', 'p_amt': '1.00'}
+>>> CreditCard(acct='4111111111111111', expdate='0130').data
+{'acct': '4111111111111111', 'expdate': '0130', 'tender': 'C'}
+>>> client = PayflowProClient('partner', 'vendor', 'username', 'password')
+>>> client.log.name, client.slow_log.name, 'logging' in sys.modules
+('payflow_pro', 'payflow_pro.slow', True)
+"""
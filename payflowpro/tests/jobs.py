@@ -0,0 +1,95 @@
+r"""
+>>> import os, shutil, tempfile
+>>> from payflowpro.classes import CreditCard, Amount, Response
+>>> from payflowpro.client import PayflowProClient, find_class_in_list
+>>> from payflowpro.jobs import JobQueue, Worker, WorkerPool, JobFailed
+>>> from payflowpro.tests.standin import StandInGateway, StandInVault
+
+>>> gateway = StandInGateway().start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url)
+>>> directory = tempfile.mkdtemp()
+>>> path = os.path.join(directory, 'jobs.db')
+
+>>> # Producers enqueue transactions instead of calling the gateway. Card
+>>> # numbers are stored as tokens from a vault, and security codes not at all.
+>>> def stored():
+...     return '\n'.join(queue.connection.iterdump())
+>>> vault = StandInVault(directory)
+>>> queue = JobQueue(path, visibility_timeout=0.2, retry_delay=0, tokenizer=vault)
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114", cvv2="987")
+>>> job_id = queue.enqueue('sale', credit_card, Amount(amt=15, currency="USD"))
+>>> queue.status(job_id), queue.result(job_id)
+('pending', None)
+>>> '4111111111111111' in stored(), 'cvv2' in stored(), '987' in stored()
+(False, False, False)
+>>> without_vault = JobQueue(path)
+>>> without_vault.enqueue('sale', credit_card, Amount(amt=15))
+Traceback (most recent call last):
+...
+ValueError: Card data can only be queued with a tokenizer
+>>> without_vault.close()
+
+>>> # A worker that reserves a job but dies before finishing it...
+>>> [job] = queue.reserve()
+>>> queue.reserve()
+[]
+
+>>> # ...loses the job to another worker once the visibility timeout expires.
+>>> import time; time.sleep(0.3)
+>>> Worker(queue, client).run_once()
+1
+>>> queue.complete(job, ([], {}))
+False
+>>> responses, unconsumed_data = queue.result(job_id)
+>>> find_class_in_list(Response, responses).respmsg
+'Approved'
+
+>>> # Every delivery used the request ID fixed when the job was enqueued.
+>>> gateway.requests[-1][1]['X-VPS-REQUEST-ID'] == job.request_id
+True
+>>> gateway.requests[-1][0]['acct'], gateway.requests[-1][0]['amt']
+('4111111111111111', '15')
+>>> 'cvv2' in gateway.requests[-1][0]
+False
+
+>>> # Jobs that keep failing are eventually marked as failed.
+>>> bad_id = queue.enqueue('no_such_method')
+>>> for i in range(queue.max_attempts):
+...     n = Worker(queue, client).run_once()
+>>> queue.result(bad_id)
+Traceback (most recent call last):
+...
+JobFailed: ...
+
+>>> # A pool of worker processes drains the queue in parallel. Each builds
+>>> # its own client, so that works with any start method.
+>>> import functools
+>>> client_factory = functools.partial(PayflowProClient, partner='paypal',
+...     vendor='foobar', username='foobar', password='password123',
+...     url_base=gateway.url)
+>>> job_ids = [queue.enqueue('authorization', credit_card, Amount(amt=i))
+...            for i in range(1, 21)]
+>>> pool = WorkerPool(path, client_factory, processes=4, start_method='spawn',
+...     queue_options=dict(tokenizer=vault),
+...     worker_options=dict(poll_interval=0.01)).start()
+>>> results = [queue.wait(job_id, timeout=30) for job_id in job_ids]
+>>> pool.stop()
+>>> len(set(responses[0].pnref for responses, unconsumed_data in results))
+20
+>>> queue.counts()['done']
+21
+
+>>> # The arguments of finished and failed jobs are deleted.
+>>> queue.connection.execute(
+...     'SELECT COUNT(*) FROM jobs WHERE arguments IS NOT NULL').fetchone()
+(0,)
+
+>>> queue.close()
+>>> shutil.rmtree(directory)
+>>> gateway.stop()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS | doctest.IGNORE_EXCEPTION_DETAIL)
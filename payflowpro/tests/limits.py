@@ -0,0 +1,54 @@
+r"""
+>>> from payflowpro.classes import CreditCard, Amount
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.limits import AIMDLimit
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> # The limit grows by about one per limit's worth of successes made
+>>> # while there were enough calls to use it, and not at all otherwise.
+>>> limit = AIMDLimit(initial=4, max_limit=8)
+>>> limit.bind(16)
+>>> for i in range(4):
+...     limit.update(0.1, True, demand=4)
+4.25
+4.485...
+4.708...
+4.920...
+>>> limit.update(0.1, True, demand=1)
+4.920...
+
+>>> # Failures and latencies well above the baseline cut it, but only
+>>> # once for the attempts that were in flight when it was last cut.
+>>> limit.update(1.0, True, demand=4)
+3.690...
+>>> limit.update(1.0, False, demand=4)
+3.690...
+>>> limit.update(None, False, demand=4)
+2.767...
+>>> limit.current(), limit.metrics()['decreases']
+(2, 2)
+
+>>> # The client feeds the outcome of every attempt to its limit
+>>> gateway = StandInGateway().start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url,
+...     max_concurrency=8, concurrency_limit=AIMDLimit(initial=2))
+>>> client.concurrency_limit
+2
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114")
+>>> results = client.batch([('sale', (credit_card, Amount(amt=1)))] * 20)
+>>> client.concurrency_limit > 2
+True
+>>> gateway.stop()
+>>> client.sale(credit_card, Amount(amt=1))
+Traceback (most recent call last):
+...
+ConnectionRefusedError: [Errno 111] Connection refused
+>>> client.concurrency_limit
+1
+>>> client.dispatcher.shutdown()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
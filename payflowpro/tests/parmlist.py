@@ -0,0 +1,76 @@
+r"""
+>>> from payflowpro.classes import CreditCard, Amount
+>>> from payflowpro.client import PayflowProClient, parse_parmlist
+>>> from payflowpro.parmlist import ParmlistParser, ResponseTooLarge
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> # However the response is split into chunks, the result is the same as
+>>> # parsing it whole, including values with lengths that hold delimiters.
+>>> parmlist = (u'RESULT=0&PNREF=V19A2E42B0F1&RESPMSG[12]=Approved&A=B'
+...             u'&COMMENT1=Fish & chips&PROFILENAME[14]=Caf\xe9 & Co=Ltd&P_AMT1=15.00')
+>>> expected = parse_parmlist(parmlist)
+>>> print(u' | '.join([expected['respmsg'], expected['comment1'], expected['profilename']]))
+Approved&A=B | Fish & chips | Café & Co=Ltd
+>>> expected['p_amt1']
+'15.00'
+
+>>> # Lengths are counted in bytes, as the client counts them in requests.
+>>> client = PayflowProClient('partner', 'vendor', 'username', 'password')
+>>> parse_parmlist(client._build_parmlist({'respmsg': u'\xc4pfel&B=1', 'result': '0'}))
+{'respmsg': 'Äpfel&B=1', 'result': '0'}
+>>> data = parmlist.encode('utf-8')
+>>> for size in range(1, len(data) + 1):
+...     parser = ParmlistParser()
+...     for i in range(0, len(data), size):
+...         parser.feed(data[i:i + size])
+...     assert parser.close() == expected, size
+>>> parser.text is None
+True
+
+>>> # The raw text is only kept when asked for.
+>>> parser = ParmlistParser(keep_text=True)
+>>> parser.feed(data)
+>>> parser.close() == expected, parser.text == parmlist
+(True, True)
+
+>>> # Responses over the limit are refused, whether their size is announced
+>>> # in advance or only found as they are read.
+>>> parser = ParmlistParser(max_bytes=64)
+>>> parser.expect(65)
+Traceback (most recent call last):
+...
+ResponseTooLarge: Response of 65 bytes exceeds the maximum of 64 bytes
+>>> parser.feed(data[:60])
+>>> parser.feed(data[60:70])
+Traceback (most recent call last):
+...
+ResponseTooLarge: Response of 70 bytes exceeds the maximum of 64 bytes
+
+>>> # The client reads each response through a parser, limited to
+>>> # max_response_bytes.
+>>> def history(parameters, pnref):
+...     return u'RESULT=0&PNREF=%s&RESPMSG=Approved&' % pnref + u'&'.join(
+...         u'P_RESULT%d=0&P_AMT%d=15.00' % (i, i) for i in range(1, 1001))
+>>> gateway = StandInGateway(responder=history).start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url)
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114")
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt=15))
+>>> responses[0].respmsg, len(responses[-1])
+('Approved', 1000)
+
+>>> # A response that is too large is not requested again.
+>>> client.max_response_bytes = 1024
+>>> requests = len(gateway.requests)
+>>> client.sale(credit_card, Amount(amt=15))
+Traceback (most recent call last):
+...
+ResponseTooLarge: Response of ... bytes exceeds the maximum of 1024 bytes
+>>> len(gateway.requests) - requests, client.endpoints.status()[0]['failures']
+(1, 0)
+>>> gateway.stop()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS | doctest.IGNORE_EXCEPTION_DETAIL)
@@ -0,0 +1,70 @@
+r"""
+>>> from payflowpro.classes import Amount, CreditCard, DoPaypal, Profile
+>>> from payflowpro.client import PayflowProClient, PreflightError
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> gateway = StandInGateway().start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url,
+...     preflight=True)
+
+>>> # Objects missing required fields, and transactions missing required
+>>> # parameters, are rejected without contacting the gateway.
+>>> client.sale(CreditCard(expdate="0114"), Amount(amt=1))
+Traceback (most recent call last):
+...
+PreflightError: Pre-flight check failed: CreditCard.acct (Required Field), acct or swipe or origid or baid (Required parameter)
+>>> try:
+...     client.capture(None)
+... except PreflightError as e:
+...     e.errors
+{'origid': 'Required parameter'}
+>>> try:
+...     client.do_checkout(DoPaypal(token='EC-1'), Amount())
+... except PreflightError as e:
+...     sorted(e.errors)
+['Amount.amt', 'DoPaypal.payerid', 'amt', 'payerid']
+>>> try:
+...     client.credit_unreferenced(CreditCard(acct=4111111111111111), Amount())
+... except PreflightError as e:
+...     sorted(e.errors)
+['Amount.amt', 'origid or amt']
+>>> try:
+...     client.profile_add(Profile(profilename='Gym', start='01012027',
+...         payperiod='MONT'), CreditCard(acct=4111111111111111), Amount(amt=10))
+... except PreflightError as e:
+...     sorted(e.errors)
+['Profile.term', 'term']
+>>> len(gateway.requests)
+0
+
+>>> # Valid transactions are sent as usual; a term of 0 is a valid value
+>>> responses, unconsumed_data = client.profile_add(Profile(profilename='Gym',
+...     start='01012027', term=0, payperiod='MONT'),
+...     CreditCard(acct=4111111111111111), Amount(amt=10))
+>>> responses, unconsumed_data = client.void('V00000000001')
+>>> len(gateway.requests)
+2
+
+>>> # Modifications only send the changes, so partial objects are fine.
+>>> responses, unconsumed_data = client.profile_modify('RP000',
+...     extras=[Profile(optionaltrx='S', optionaltrxamt=12.00)])
+>>> try:
+...     client.profile_modify(None, extras=[Profile(term=12)])
+... except PreflightError as e:
+...     e.errors
+{'origprofileid': 'Required parameter'}
+>>> len(gateway.requests)
+3
+
+>>> # Without pre-flight checks, the gateway is left to reject them
+>>> client.preflight = False
+>>> responses, unconsumed_data = client.capture(None)
+>>> len(gateway.requests)
+4
+>>> gateway.stop()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS | doctest.IGNORE_EXCEPTION_DETAIL)
@@ -0,0 +1,70 @@
+r"""
+>>> import pickle
+>>> from decimal import Decimal
+>>> from payflowpro.classes import Amount, CreditCard, PayflowProObject, Field
+>>> from payflowpro.classes import RecurringPayments, ResultSet
+>>> from payflowpro.serialization import dumps, loads, _sample_results, _pickle_fields
+
+>>> result_objects, unconsumed_data = _sample_results()
+>>> result_objects.unconsumed_data['extra'] = 'kept'
+>>> data = dumps((result_objects, unconsumed_data))
+>>> data[:5]
+b'PFS\x01\x00'
+>>> copy, copy_unconsumed = loads(data)
+>>> isinstance(copy, ResultSet), copy_unconsumed
+(True, {'extra': 'kept'})
+>>> [obj.__class__.__name__ for obj in copy] == \
+...     [obj.__class__.__name__ for obj in result_objects]
+True
+>>> [str(obj) for obj in copy[:-1]] == [str(obj) for obj in result_objects[:-1]]
+True
+>>> payments = copy[-1]
+>>> isinstance(payments, RecurringPayments), [p.p_result for p in payments]
+(True, ['0', '12'])
+>>> [(number, p.p_pnref) for number, p in payments.numbered()]
+[(1, 'V18A2F5C2F47'), (2, 'V18A2F5C2F48')]
+>>> copy.pnref, copy.unconsumed_data
+('V19A2E42B0F1', {'extra': 'kept'})
+
+>>> # Raw values are kept, including those `data` leaves out, and fields
+>>> # without a value still fall back to their defaults.
+>>> card = loads(dumps(CreditCard(acct='4111-1111-1111-1111', expdate=0)))
+>>> card.acct, card.expdate, card.tender
+('4111111111111111', 0, 'C')
+
+>>> # Values marshal can't encode are pickled instead
+>>> data = dumps([Amount(amt=Decimal('1.50')), {'count': 2}])
+>>> data[4]
+1
+>>> loads(data)[0].amt, loads(data)[1]
+(Decimal('1.50'), {'count': 2})
+
+>>> # Classes outside payflowpro.classes are written by name
+>>> import payflowpro.tests.serialization as module
+>>> class Custom(PayflowProObject):
+...     custom_note = Field()
+>>> Custom.__module__, module.Custom = module.__name__, Custom
+>>> loads(dumps(Custom(custom_note='bar'))).custom_note
+'bar'
+
+>>> loads(b'PFS\x09\x00')
+Traceback (most recent call last):
+...
+ValueError: Unsupported serialization format version 9
+>>> loads(b'not a payload')
+Traceback (most recent call last):
+...
+ValueError: Not a serialized PayflowProObject payload
+
+>>> # pickle uses the field values only too
+>>> copy = pickle.loads(pickle.dumps(result_objects))
+>>> copy.pnref, copy.unconsumed_data, str(copy[0]) == str(result_objects[0])
+('V19A2E42B0F1', {'extra': 'kept'}, True)
+>>> len(dumps(result_objects)) < len(pickle.dumps(result_objects)) \
+...     < len(_pickle_fields(result_objects))
+True
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
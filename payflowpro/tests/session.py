@@ -0,0 +1,91 @@
+r"""
+>>> import asyncio
+>>> from decimal import Decimal
+>>> from payflowpro.classes import Amount, SetPaypal
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.express import ExpressCheckoutSession
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> def express(parameters, pnref):
+...     if parameters['action'] == 'S':
+...         return 'RESULT=0&RESPMSG=Approved&TOKEN=EC-17C76533PL706494P'
+...     if parameters['action'] == 'G':
+...         return ('RESULT=0&RESPMSG=Approved&TOKEN=%s&PAYERID=1234567890123'
+...                 '&PAYERSTATUS=verified' % parameters['token'])
+...     return 'RESULT=0&RESPMSG=Approved&PNREF=%s&PPREF=8PD67445TA0599727' % pnref
+
+>>> gateway = StandInGateway(express).start()
+>>> client = PayflowProClient(partner='PayPal', vendor='foo', username='bar',
+...     password='password123', url_base=gateway.url)
+>>> session = ExpressCheckoutSession(client)
+
+>>> amt = Amount(amt=Decimal('44.00'), freightamt=Decimal('4.00'), currency='USD')
+>>> setpp = SetPaypal(returnurl='https://127.0.0.1:8000/shop/confirm/',
+...     cancelurl='https://127.0.0.1:8000/shop/cart/')
+
+>>> # First step: get a token and send the buyer to PayPal.
+>>> checkout = session.set_checkout(setpp, amt)
+>>> checkout.token, checkout.state
+('EC-17C76533PL706494P', 'set')
+>>> checkout.redirect_url == client.redirect + checkout.token
+True
+
+>>> # The confirmation page may be reloaded; details are fetched once.
+>>> details = session.get_checkout(checkout.token)
+>>> details = session.get_checkout(checkout.token)
+>>> details.payerid, checkout.state
+('1234567890123', 'details')
+>>> [p['action'] for p, h in gateway.requests]
+['S', 'G']
+
+>>> # Completing uses the cached payer ID, and is never done twice.
+>>> responses, unconsumed = session.do_checkout(checkout.token, amt)
+>>> responses, unconsumed = session.do_checkout(checkout.token, amt)
+>>> checkout.state, [p['action'] for p, h in gateway.requests]
+('completed', ['S', 'G', 'D'])
+>>> gateway.requests[-1][0]['payerid']
+'1234567890123'
+
+>>> # The same flow from a coroutine.
+>>> async def flow():
+...     checkout = await session.set_checkout_async(setpp, amt)
+...     session.forget(checkout.token)
+...     details = await asyncio.gather(*[
+...         session.get_checkout_async(checkout.token) for i in range(5)])
+...     return await session.do_checkout_async(checkout.token, amt)
+>>> responses, unconsumed = asyncio.run(flow())
+>>> responses[0].respmsg
+'Approved'
+>>> [p['action'] for p, h in gateway.requests][3:]
+['S', 'G', 'D']
+
+>>> gateway.stop()
+
+>>> # Calls run concurrently each get a request ID of their own, so the
+>>> # gateway never takes one for a repeat of another.
+>>> from payflowpro.classes import CreditCard
+>>> from payflowpro.client import CurrentTimeIdGenerator, RandomIdGenerator
+>>> cards = [CreditCard(acct=4111111111111111, expdate='0130'),
+...          CreditCard(acct=5555555555554444, expdate='0130')]
+>>> for idgenerator in (None, CurrentTimeIdGenerator()):
+...     gateway = StandInGateway().start()
+...     options = dict(idgenerator=idgenerator) if idgenerator else {}
+...     client = PayflowProClient(partner='PayPal', vendor='foo', username='bar',
+...         password='password123', url_base=gateway.url, max_concurrency=8, **options)
+...     results = client.batch([('sale', (cards[i % 2], Amount(amt=i + 1)))
+...                             for i in range(8)])
+...     print(len(set(h['X-VPS-REQUEST-ID'] for p, h in gateway.requests)),
+...           len(set(responses[0].pnref for responses, unconsumed in results)))
+...     client.dispatcher.shutdown()
+...     gateway.stop()
+8 8
+8 8
+>>> for idgenerator in (RandomIdGenerator(), CurrentTimeIdGenerator()):
+...     print(len(set(idgenerator.id() for i in range(1000))))
+1000
+1000
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod()
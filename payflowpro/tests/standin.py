@@ -0,0 +1,118 @@
+"""
+A local stand-in for the Payflow Pro HTTPS gateway, used by the tests that
+do not need a real Payflow Pro account.
+
+The server listens on 127.0.0.1 and answers every POST with the PARMLIST
+produced by its `responder`, which is called with the parsed request
+parameters and a PNREF. Like the real gateway, requests that repeat an
+X-VPS-REQUEST-ID get the original response back instead of being
+processed again. Responses are sent after `delay` seconds, or after
+`delay(n)` seconds for the n-th request if it is callable. Point a client
+at `gateway.url`:
+
+>>> gateway = StandInGateway().start()
+>>> client = PayflowProClient('paypal', 'vendor', 'user', 'pwd',
+...                           url_base=gateway.url)
+>>> gateway.stop()
+"""
+import os
+import threading
+import uuid
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+
+from payflowpro.client import PayflowProClient
+from payflowpro.client import parse_parmlist
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def approve(parameters, pnref):
+    """Default responder: approves every transaction."""
+    return 'RESULT=0&PNREF=%s&RESPMSG=Approved&AUTHCODE=010101' % pnref
+
+
+class StandInGateway(object):
+    def __init__(self, responder=approve, delay=0):
+        self.responder = responder
+        self.delay = delay
+        self.requests = []
+        self.responses = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _handler(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf-8')
+                parameters = parse_parmlist(body)
+                headers = self.headers
+                request_id = headers.get('X-VPS-REQUEST-ID')
+                with gateway._lock:
+                    gateway.requests.append((parameters, headers))
+                    payload = gateway.responses.get(request_id)
+                    if payload is None:
+                        pnref = 'V%011d' % len(gateway.responses)
+                        payload = gateway.responder(parameters, pnref)
+                        gateway.responses[request_id] = payload
+                delay = gateway.delay
+                if callable(delay):
+                    delay = delay(len(gateway.requests))
+                if delay:
+                    threading.Event().wait(delay)
+                payload = payload.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/namevalue')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = _ThreadingServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+
+class StandInVault(object):
+    """
+    A stand-in for a card vault, for use as the tokenizer of a `JobQueue`.
+    Each value is kept in a file of its own under `directory`, named by its
+    token, so that worker processes can read the values too.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def tokenize(self, value):
+        token = uuid.uuid4().hex
+        with open(os.path.join(self.directory, token), 'w') as f:
+            f.write(value)
+        return token
+
+    def detokenize(self, token):
+        with open(os.path.join(self.directory, token)) as f:
+            return f.read()
@@ -0,0 +1,60 @@
+r"""
+>>> from payflowpro.classes import Amount, CreditCard, PurchaseInfo
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.suppression import DuplicateSuppressor
+>>> from payflowpro.tests.standin import StandInGateway, approve
+
+>>> def responder(parameters, pnref):
+...     if parameters['amt'] == '13.00':
+...         return 'RESULT=12&PNREF=%s&RESPMSG=Declined' % pnref
+...     return approve(parameters, pnref)
+>>> gateway = StandInGateway(responder, delay=0.2).start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url,
+...     duplicates=DuplicateSuppressor(window=60))
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114")
+
+>>> # A double click: the second sale waits for the first and gets its result
+>>> first = client.submit('sale', credit_card, Amount(amt='10.00', currency='USD'))
+>>> second = client.submit('sale', CreditCard(acct='4111 1111 1111 1111',
+...     expdate="0114"), Amount(amt=10, currency='USD'), request_id=2)
+>>> first.result() is second.result(), len(gateway.requests)
+(True, 1)
+
+>>> # Once completed, a repeat within the window returns the same result
+>>> client.sale(credit_card, Amount(amt='10.0', currency='USD')) is first.result()
+True
+>>> client.duplicates.suppressed, len(gateway.requests)
+(2, 1)
+
+>>> # Different amounts, currencies, references or transaction types are
+>>> # different payments
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt='10.00', currency='EUR'))
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt='10.00', currency='USD'),
+...     extras=[PurchaseInfo(ponum='order 2')])
+>>> responses, unconsumed_data = client.authorization(credit_card, Amount(amt='10.00', currency='USD'))
+>>> len(gateway.requests), len(client.duplicates)
+(4, 4)
+
+>>> # Declined payments are not remembered
+>>> [client.sale(credit_card, Amount(amt='13.00'))[0].result for i in range(2)]
+['12', '12']
+>>> len(gateway.requests)
+6
+
+>>> # Payments are forgotten after the window, or once there are too many
+>>> client.duplicates = DuplicateSuppressor(window=0)
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt='10.00', currency='USD'))
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt='10.00', currency='USD'))
+>>> client.duplicates = DuplicateSuppressor(capacity=1)
+>>> for amt in ('1.00', '2.00', '1.00'):
+...     responses, unconsumed_data = client.sale(credit_card, Amount(amt=amt))
+>>> len(gateway.requests), len(client.duplicates)
+(11, 1)
+>>> client.dispatcher.shutdown()
+>>> gateway.stop()
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
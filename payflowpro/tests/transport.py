@@ -0,0 +1,48 @@
+r"""
+>>> import logging
+>>> from payflowpro.classes import CreditCard, Amount
+>>> from payflowpro.client import PayflowProClient
+>>> from payflowpro.transport import AttemptTimings, Transport
+>>> from payflowpro.tests.standin import StandInGateway
+
+>>> gateway = StandInGateway(delay=0.2).start()
+>>> client = PayflowProClient(partner='paypal', vendor='foobar',
+...     username='foobar', password='password123', url_base=gateway.url,
+...     slow_call_threshold=0.1)
+>>> credit_card = CreditCard(acct=4111111111111111, expdate="0114")
+
+>>> # Slow calls are logged with their timing breakdown.
+>>> class Collect(logging.Handler):
+...     messages = []
+...     def emit(self, record):
+...         self.messages.append(record.getMessage())
+>>> client.slow_log.addHandler(Collect())
+
+>>> responses, unconsumed_data = client.sale(credit_card, Amount(amt=1),
+...                                          request_id=7)
+>>> metadata = responses.metadata
+>>> metadata['request_id'], len(metadata['attempts'])
+(7, 1)
+>>> timings = metadata['attempts'][0]
+>>> [name for name, value in sorted(timings.as_dict().items()) if value is None]
+['error', 'tls']
+>>> timings.first_byte >= 0.2 > timings.connect
+True
+>>> print(Collect.messages[0])
+Slow call: request 7 (S/None) took ...s in 1 attempts
+  attempt 1: dns=...ms connect=...ms first_byte=...ms body=...ms total=...ms
+
+>>> # Failed attempts keep the timings of the phases they reached.
+>>> gateway.stop()
+>>> timings = AttemptTimings(gateway.url)
+>>> Transport().send(gateway.url, b'', {}, 1, timings)
+Traceback (most recent call last):
+...
+ConnectionRefusedError: ...
+>>> timings.dns is not None, timings.connect, timings.error
+(True, None, 'ConnectionRefusedError: [Errno 111] Connection refused')
+"""
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
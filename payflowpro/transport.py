@@ -0,0 +1,235 @@
+"""
+The HTTP transport used by `PayflowProClient` to talk to the gateway.
+
+Unlike `urlopen`, `Transport` performs each step of a request itself so
+that it can time them: name resolution, TCP connect, TLS handshake, the
+wait for the first byte of the response (mostly gateway processing time)
+and the transfer of the response body. The timings of every attempt are
+attached to the result's metadata, which makes it possible to tell network
+problems from slow gateway responses.
+
+Requests that must go through an HTTP proxy configured in the environment
+are sent with `urlopen`, and only their total time is recorded.
+
+A request can be aborted from another thread with a `Cancellation`, which
+shuts down its connection. Requests sent through a proxy can't be
+cancelled, and run to completion.
+
+The networking modules are imported by the first request rather than with
+this module, since together they take longer to import than the rest of
+the package.
+"""
+import threading
+import time
+
+PHASES = ('dns', 'connect', 'tls', 'first_byte', 'body')
+
+CHUNK_SIZE = 16384 # Bytes read from the response at a time
+
+
+class AttemptTimings(object):
+    """
+    The time in seconds spent in each phase of a single attempt. Phases
+    that were not reached, or not measured, are None.
+    """
+
+    def __init__(self, url=None):
+        self.url = url
+        self.dns = None
+        self.connect = None
+        self.tls = None
+        self.first_byte = None
+        self.body = None
+        self.total = None
+        self.error = None
+        # Whether a connection to the endpoint was made: None if unknown, as
+        # for requests sent through a proxy
+        self.connected = None
+
+    def as_dict(self):
+        return dict([(name, getattr(self, name)) for name in
+                     ('url',) + PHASES + ('total', 'error')])
+
+    def __str__(self):
+        phases = ['%s=%.1fms' % (name, getattr(self, name) * 1000)
+                  for name in PHASES + ('total',) if getattr(self, name) is not None]
+        if self.error:
+            phases.append('error=%s' % self.error)
+        return ' '.join(phases)
+
+
+class RequestCancelled(Exception):
+    """Raised by a request that was cancelled before it finished."""
+
+
+class Cancellation(object):
+    """
+    Lets another thread abort a request: `cancel` shuts down the request's
+    connection, so that the thread sending it raises an error straight
+    away instead of waiting for a response until its timeout.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def attach(self, sock):
+        """
+        Makes `cancel` shut down `sock`. Raises `RequestCancelled` if the
+        request has already been cancelled.
+        """
+        with self._lock:
+            if self.cancelled:
+                raise RequestCancelled('Request cancelled')
+            self._sock = sock
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            import socket
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass # Already closed
+
+
+class Transport(object):
+    """Sends PARMLIST requests over HTTP(S) and times each phase."""
+
+    def __init__(self, ssl_context=None):
+        self._ssl_context = ssl_context
+
+    def _get_ssl_context(self):
+        if self._ssl_context is None:
+            import ssl
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    def send(self, url, data, headers, timeout, timings=None, parser=None,
+        cancellation=None):
+        """
+        POSTs `data` to `url` and returns the response body as bytes. The
+        phases are recorded in `timings`, an `AttemptTimings`, which is
+        also filled in as far as the request got when an exception is
+        raised.
+
+        With a `parser`, such as a `ParmlistParser`, the body is instead fed
+        to the parser as it is read, and the result of closing the parser
+        is returned. A `cancellation`, if given, can abort the request
+        from another thread.
+        """
+        from urllib.parse import urlsplit
+        from urllib.request import getproxies
+        from urllib.request import proxy_bypass
+
+        if timings is None:
+            timings = AttemptTimings(url)
+        started = time.monotonic()
+        try:
+            parts = urlsplit(url)
+            proxies = getproxies()
+            if parts.scheme in proxies and not proxy_bypass(parts.hostname):
+                return self._send_urlopen(url, data, headers, timeout, timings, parser)
+            return self._send_direct(parts, data, headers, timeout, timings, parser,
+                cancellation)
+        except Exception as e:
+            timings.error = '%s: %s' % (e.__class__.__name__, e)
+            raise
+        finally:
+            timings.total = time.monotonic() - started
+
+    def _read(self, response, parser):
+        if parser is None:
+            return response.read()
+        length = response.getheader('Content-Length')
+        if length is not None and length.strip().isdigit():
+            parser.expect(int(length))
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                return parser.close()
+            parser.feed(chunk)
+
+    def _send_urlopen(self, url, data, headers, timeout, timings, parser):
+        from urllib.error import HTTPError
+        from urllib.request import Request
+        from urllib.request import urlopen
+
+        try:
+            response = urlopen(Request(url=url, data=data, headers=headers), timeout=timeout)
+        except HTTPError:
+            # The endpoint answered, through the proxy
+            timings.connected = True
+            raise
+        timings.connected = True
+        try:
+            return self._read(response, parser)
+        finally:
+            response.close()
+
+    def _send_direct(self, parts, data, headers, timeout, timings, parser,
+        cancellation=None):
+        import socket
+        from http.client import HTTPConnection
+        from urllib.error import HTTPError
+
+        https = parts.scheme == 'https'
+        host = parts.hostname
+        timings.connected = False
+        port = parts.port or (443 if https else 80)
+
+        mark = time.monotonic()
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        now = time.monotonic()
+        timings.dns, mark = now - mark, now
+
+        sock = None
+        error = None
+        for family, socktype, proto, canonname, address in addresses:
+            try:
+                sock = socket.socket(family, socktype, proto)
+                sock.settimeout(timeout)
+                sock.connect(address)
+                break
+            except socket.error as e:
+                error = e
+                if sock is not None:
+                    sock.close()
+                sock = None
+        if sock is None:
+            raise error or socket.error('No addresses found for %s' % host)
+        now = time.monotonic()
+        timings.connect, mark = now - mark, now
+        timings.connected = True
+
+        try:
+            if cancellation is not None:
+                cancellation.attach(sock)
+            if https:
+                sock = self._get_ssl_context().wrap_socket(sock, server_hostname=host)
+                now = time.monotonic()
+                timings.tls, mark = now - mark, now
+                if cancellation is not None:
+                    cancellation.attach(sock)
+
+            connection = HTTPConnection(host, port, timeout=timeout)
+            connection.sock = sock
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            connection.request('POST', path, body=data, headers=headers)
+            response = connection.getresponse()
+            now = time.monotonic()
+            timings.first_byte, mark = now - mark, now
+
+            if response.status >= 400:
+                raise HTTPError(parts.geturl(), response.status, response.reason,
+                                response.msg, None)
+            body = self._read(response, parser)
+            timings.body = time.monotonic() - mark
+            return body
+        finally:
+            sock.close()
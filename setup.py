@@ -62,9 +62,11 @@ setup(
     url = 'http://github.com/bkeating/python-payflowpro/',
     packages = packages,
     data_files = data_files,
+    python_requires = '>=3.8',
     classifiers = ['Development Status :: 4 - Beta',
                    'Intended Audience :: Developers',
                    'License :: OSI Approved :: Apache Software License',
                    'Operating System :: OS Independent',
                    'Programming Language :: Python',
+                   'Programming Language :: Python :: 3',
                    'Topic :: Software Development :: Libraries :: Python Modules'])